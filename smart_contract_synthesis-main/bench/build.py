@@ -0,0 +1,41 @@
+# Time spent building the transition relation of a synthetic contract, before any
+# solving: every transition writes a few of the states and reads a few others.
+# usage: python3 bench/build.py [states] [transitions]
+import z3
+import sys
+import time
+sys.path.insert(1, './')
+from lib.state_machine import smart_contract_state_machine
+
+n_states = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+n_transitions = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+T0 = time.time()
+statemachine = smart_contract_state_machine('synthetic')
+states = []
+for i in range(n_states):
+    if i % 4 == 0:
+        states.append(statemachine.add_state("m%d" % i, z3.ArraySort(z3.BitVecSort(256), z3.BitVecSort(256))))
+    else:
+        states.append(statemachine.add_state("s%d" % i, z3.BitVecSort(256)))
+T1 = time.time()
+for t in range(n_transitions):
+    account = z3.BitVec("account%d" % t, 256)
+    amount = z3.BitVec("amount%d" % t, 256)
+    updates = []
+    for k in range(3):
+        i = (t * 3 + k) % n_states
+        j = (t * 7 + k + 1) % n_states
+        state, stateOut = states[i]
+        read = states[j][0] if not z3.is_array(states[j][0]) else states[j][0][account]
+        if z3.is_array(state):
+            updates.append(stateOut == z3.Store(state, account, state[account] + amount + read))
+        else:
+            updates.append(stateOut == state + amount + read)
+    statemachine.add_tr("tr%d" % t, [account, amount], True, z3.And(updates))
+T2 = time.time()
+statemachine.add_once()
+T3 = time.time()
+size = sum(len(statemachine.transfer_func[tr].sexpr()) for tr in statemachine.transitions)
+print("states | transitions | add_state (s) | add_tr (s) | add_once (s) | total (s) | size")
+print(n_states, "|", n_transitions, "| %.2f | %.2f | %.2f | %.2f |" % (T1 - T0, T2 - T1, T3 - T2, T3 - T0), size)
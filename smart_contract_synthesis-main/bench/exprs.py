@@ -0,0 +1,56 @@
+# Free variables and containment on the largest transfer functions of the contracts
+# in input/: the recursive traversals lib/ used before (string comparison, shared
+# subterms revisited) against lib.expr_utils.
+# usage: python3 bench/exprs.py [count] [input/erc20.py ...]
+import z3
+import sys
+import glob
+import time
+sys.path.insert(1, './')
+from lib.contracts import load
+import lib.expr_utils as expr_utils
+
+def contains(x, e):
+    return x.__repr__() == e.__repr__() or any([contains(x, c) for c in e.children()])
+
+def get_vars(f):
+    r = set()
+    def collect(f):
+        if z3.is_const(f):
+            if f.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                r.add(f)
+        else:
+            for c in f.children():
+                collect(c)
+    collect(f)
+    return r
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 5
+files = [f for f in sys.argv[1:] if not f.isdigit()] or sorted(glob.glob('./input/*.py'))
+funcs = []
+for file in files:
+    try:
+        statemachine = load(file)[0]
+    except Exception as e:
+        print(file, "| skipped:", repr(e))
+        continue
+    variables = [v for s in statemachine.ts.pre_post_vars() for v in s]
+    for tr in statemachine.transitions:
+        funcs.append((statemachine.name, tr, statemachine.transfer_func[tr], variables))
+funcs.sort(key=lambda f: -expr_utils.tree_size(f[2]))
+print("contract | transition | dag size | tree size | depth | get_vars (s) | free_vars (s) | contains (s) | expr_utils.contains (s)")
+for name, tr, f, variables in funcs[:count]:
+    T0 = time.time()
+    old = get_vars(f)
+    T1 = time.time()
+    expr_utils._cache.clear()
+    new = expr_utils.free_vars(f)
+    T2 = time.time()
+    old_contains = [contains(v, f) for v in variables]
+    T3 = time.time()
+    expr_utils._cache.clear()
+    new_contains = [expr_utils.contains(v, f) for v in variables]
+    T4 = time.time()
+    assert set(v.__str__() for v in old) == set(v.__str__() for v in new) and old_contains == new_contains
+    print(name, "|", tr, "|", expr_utils.dag_size(f), "|", expr_utils.tree_size(f), "|", expr_utils.depth(f),
+          "| %.4f | %.4f | %.4f | %.4f" % (T1 - T0, T2 - T1, T3 - T2, T4 - T3))
@@ -0,0 +1,24 @@
+# Synthesis with the counterexamples kept as bmc found them, minimized over their
+# steps, and minimized over their steps and parameter values (cegis minimize).
+# usage: python3 bench/minimize.py [input/wallet.py ...]
+import sys
+import glob
+import time
+sys.path.insert(1, './')
+from lib.contracts import load
+
+files = sys.argv[1:] or sorted(glob.glob('./input/*.py'))
+rows = []
+for file in files:
+    for minimize in (False, True, 'values'):
+        try:
+            statemachine, properties, positive_traces, candidate_guard = load(file)
+        except Exception as e:
+            rows.append([file, "skipped: " + repr(e)])
+            break
+        T1 = time.time()
+        result = statemachine.cegis(properties, positive_traces, candidate_guard, minimize=minimize)
+        rows.append([statemachine.name, str(minimize), result.status, str(result.iterations), "%.2f" % (time.time() - T1)])
+print("contract | minimize | status | iterations | time (s)")
+for row in rows:
+    print(" | ".join(row))
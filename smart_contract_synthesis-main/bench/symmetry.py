@@ -0,0 +1,30 @@
+# Query time of BMC with and without address symmetry breaking, per contract and property.
+# usage: python3 bench/symmetry.py [input/erc20.py ...]
+import z3
+import sys
+import glob
+import time
+sys.path.insert(1, './')
+from lib.contracts import load
+
+files = sys.argv[1:] or sorted(glob.glob('./input/*.py'))
+print("contract | property | address parameters | off (s) | on (s) | off | on")
+for file in files:
+    try:
+        statemachine, properties, positive_traces, candidate_guard = load(file)
+    except Exception as e:
+        print(file, "| skipped:", repr(e))
+        continue
+    for i, p in enumerate(properties):
+        addresses = [v.__str__() for v in statemachine.address_parameters(z3.Not(p))]
+        times = []
+        results = []
+        for symmetry in (False, True):
+            T1 = time.time()
+            ntrace = statemachine.bmc(z3.Not(p), symmetry=symmetry)
+            times.append("%.2f" % (time.time() - T1))
+            if ntrace != None:
+                results.append("×")
+            else:
+                results.append("?" if statemachine.last_bmc.status == 'inconclusive' else "√")
+        print(statemachine.name, "| r%d |" % (i + 1), " ".join(addresses) or "-", "|", " | ".join(times + results))
@@ -0,0 +1,54 @@
+# Preprocessing time versus solving time of the BMC queries of each contract under
+# every tactic profile. A profile is rejected if it changes the verdict of a depth
+# of a property decided without preprocessing ('none'); the others are ranked by
+# depths decided, then by time. With --save the best profile is stored for the
+# contract in the output directory CEGIS_OUTPUT_DIR, where bmc looks it up.
+# usage: CEGIS_OUTPUT_DIR=out python3 bench/tactics.py [--save] [input/erc20.py ...]
+import z3
+import sys
+import glob
+import time
+sys.path.insert(1, './')
+from lib.contracts import load
+from lib.preprocess import PROFILES, CONTRACT_PROFILES, new_stats, save_profile
+from lib.portfolio import path_for
+
+save = '--save' in sys.argv
+if save and path_for(CONTRACT_PROFILES) == None:
+    sys.exit("--save needs an output directory (CEGIS_OUTPUT_DIR)")
+files = [f for f in sys.argv[1:] if f != '--save'] or sorted(glob.glob('./input/*.py'))
+print("contract | profile | preprocess (s) | solve (s) | total (s) | queries | failed tactics | verified | decided | verdicts")
+for file in files:
+    try:
+        statemachine, properties, positive_traces, candidate_guard = load(file)
+    except Exception as e:
+        print(file, "| skipped:", repr(e))
+        continue
+    best = None
+    reference = None
+    for profile in PROFILES:
+        statemachine.tactic_profile = profile
+        statemachine.solver_stats = new_stats()
+        T1 = time.time()
+        verified = 0
+        # (property, depth) -> 'violated' or 'proved'
+        verdicts = {}
+        for i, p in enumerate(properties):
+            statemachine.bmc(z3.Not(p))
+            verified += statemachine.last_bmc.status == 'proved'
+            for depth, status in statemachine.last_bmc.depths.items():
+                if status != 'inconclusive':
+                    verdicts[i, depth] = status
+        total = time.time() - T1
+        if reference == None:
+            reference = verdicts
+        changed = [k for k in verdicts if k in reference and verdicts[k] != reference[k]]
+        stats = statemachine.solver_stats
+        print(statemachine.name, "|", profile, "| %.2f | %.2f | %.2f |" % (stats['preprocess'], stats['solve'], total),
+              stats['queries'], "|", stats['failed'], "| %d/%d |" % (verified, len(properties)), len(verdicts), "|",
+              "%d changed, rejected" % len(changed) if changed else "same")
+        if changed == [] and (best == None or (-len(verdicts), total) < best[1]):
+            best = (profile, (-len(verdicts), total))
+    print(statemachine.name, "| best:", best[0])
+    if save:
+        save_profile(statemachine.name, best[0])
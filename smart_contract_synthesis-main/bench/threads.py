@@ -0,0 +1,27 @@
+# Synthesis of several contracts one after the other, then concurrently in a thread
+# pool with one z3 context per state machine.
+# usage: python3 bench/threads.py [workers] [input/wallet.py ...]
+import z3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(1, './')
+from lib.contracts import load
+
+workers = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 4
+files = [f for f in sys.argv[1:] if not f.isdigit()] or ['./input/wallet.py', './input/tokenPartition.py', './input/voting.py', './input/vestingWallet.py']
+
+def synthesize(file):
+    statemachine, properties, positive_traces, candidate_guard = load(file, z3.Context())
+    statemachine.cegis(properties, positive_traces, candidate_guard)
+    return statemachine.condition_guards
+
+T0 = time.time()
+sequential = [synthesize(file) for file in files]
+T1 = time.time()
+with ThreadPoolExecutor(workers) as pool:
+    concurrent = list(pool.map(synthesize, files))
+T2 = time.time()
+print("contracts | workers | sequential (s) | threads (s) | same guards")
+print(len(files), "|", workers, "| %.2f | %.2f |" % (T1 - T0, T2 - T1),
+      all(str(a) == str(b) for a, b in zip(sequential, concurrent)))
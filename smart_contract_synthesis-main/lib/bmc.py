@@ -1,88 +1,372 @@
-import z3,sys
-
-index = 0
-
-def pure_name(name):
-    if "|" in name:
-        return name[:name.index('|')]
-    else:
-        return name
-    
-def fresh(round, s, name):
-    # print("s = ",s)
-    global index
-    index += 1
-    return z3.Const(name+"|r%d|i%d" % (round, index), s)
+import z3,os,sys,time
+from lib.portfolio import configs_for, make_solver, race, record_winner, encode_model, decode_model
+from lib.preprocess import preprocess, is_local, check
+from lib.expr_utils import free_vars
 
 def zipp(xs, ys):
     # print("xs:", xs)
     # print("ys:", ys)
     return [p for p in zip(xs, ys)]
 
-def bmc(init, trans, goal, fvs, xs, xns):
-    s = z3.Solver()
-    s.set("timeout", 2000)
-    s.add(init)
-    count = 0
+def complete_model(model, f):
+    '''A model of every constant in f with the values of model'''
+    s = z3.Solver(ctx=f.ctx)
+    s.add([v == model.eval(v, model_completion=True) for v in free_vars(f)])
+    s.check()
+    return s.model()
+
+class BmcUnrolling(object):
+    """Per-step tables of the copies of the state variables and parameters.
+
+    states[k] maps the name of each pre-state variable in xs to its copy in the
+    state after k transitions, params[k] maps the name of each parameter in fvs
+    to its copy used by transition k (params[0] is unused). Step 0 uses xs, step 1
+    uses xns and fvs themselves, later steps use constants named name@k.
+
+    >>> x, x_out = z3.Int('x'), z3.Int("x'")
+    >>> u = BmcUnrolling([x], [x_out], [])
+    >>> u.step(x_out == x + 1, 2)
+    x@2 == x' + 1
+    >>> u.states[2]
+    {'x': x@2}
+    """
+    def __init__(self, xs, xns, fvs):
+        self.xs = xs
+        self.xns = xns
+        self.fvs = fvs
+        self.states = [dict(zip(self.names(xs), xs)), dict(zip(self.names(xs), xns))]
+        self.params = [None, dict(zip(self.names(fvs), fvs))]
+
+    def names(self, vs):
+        return [v.__str__() for v in vs]
+
+    def extend(self, k):
+        while len(self.states) <= k:
+            n = len(self.states)
+            self.states.append({name: z3.Const("%s@%d" % (name, n), v.sort()) for name, v in zip(self.names(self.xs), self.xs)})
+            self.params.append({name: z3.Const("%s@%d" % (name, n), v.sort()) for name, v in zip(self.names(self.fvs), self.fvs)})
+
+    def state(self, k):
+        self.extend(k)
+        return list(self.states[k].values())
+
+    def param(self, k):
+        self.extend(k)
+        return list(self.params[k].values())
+
+    def step(self, trans, k):
+        '''trans over (xs, xns, fvs) as transition k, from state k-1 to state k'''
+        return z3.substitute(trans, zipp(self.xs + self.xns + self.fvs, self.state(k-1) + self.state(k) + self.param(k)))
+
+    def at(self, e, k):
+        '''e over xs as a formula on state k; post-state names (e.g. now') denote state k too'''
+        return z3.substitute(e, zipp(self.xs + self.xns, self.state(k) + self.state(k)))
+
+    def post(self, e, k):
+        '''e over xns and fvs as a formula on transition k'''
+        return z3.substitute(e, zipp(self.xns + self.fvs, self.state(k) + self.param(k)))
+
+    def trace(self, model, depth):
+        '''Values of the states 0..depth and of the parameters of transitions 1..depth'''
+        self.extend(depth)
+        states = [{name: model.eval(v, model_completion=True) for name, v in self.states[k].items()} for k in range(depth + 1)]
+        params = [None] + [{name: model.eval(v, model_completion=True) for name, v in self.params[k].items()} for k in range(1, depth + 1)]
+        return states, params
+
+def greater(a, b):
+    if z3.is_bv(a):
+        return z3.UGT(a, b)
+    return a > b
+
+# solver timeouts (ms) tried in turn on a depth whose result is unknown
+TIMEOUTS = (2000, 8000, 32000)
+# total solver time (ms) of one bmc call, None for no limit
+BUDGET = 60000
+# default number of transitions unrolled
+BOUND = 7
+# total solver time (ms) of one cube in cube_bmc
+CUBE_BUDGET = 30000
+
+class BmcResult(object):
+    """Outcome of a bounded model check.
+
+    status is 'violated' (model holds the counterexample), 'proved' (no
+    counterexample up to the bound) or 'inconclusive' (some depth stayed
+    unknown or was not checked). depths maps each checked depth (number of transitions) to 'violated',
+    'proved' or 'inconclusive'; depth is the length of the counterexample, which
+    BmcUnrolling(xs, xns, fvs).trace(model, depth) decodes. models lists model and
+    the further counterexamples of the same depth bmc was asked for.
+    """
+    def __init__(self):
+        self.status = 'proved'
+        self.model = None
+        self.depth = None
+        self.depths = {}
+        self.models = []
+
+    def __repr__(self):
+        return 'BmcResult(%s, %s)' % (self.status, self.depths)
+
+def bmc(init, trans, goal, fvs, xs, xns, commute=None, symmetric=None, config=None, profile=None, stats=None,
+        timeouts=TIMEOUTS, budget=BUDGET, handoff=False, bound=BOUND, prefix=None, start=0, count=1, block=None,
+        diverse=True):
+    """commute: optional pairs (first, second) of formulas over xns; no two adjacent
+       steps satisfy first then second, except the last two steps before the goal
+       (used for partial-order reduction of independent transitions)
+       symmetric: optional pairs (v, taken) of an interchangeable parameter in fvs and
+       a formula over xns telling whether the step uses it; the used values must
+       appear in increasing order of first occurrence (address symmetry breaking)
+       config: name of the solver configuration in lib.portfolio.CONFIGS
+       profile: preprocessing profile in lib.preprocess.PROFILES, applied to each
+       frame, or to each whole query if it eliminates variables; stats collects
+       preprocessing and solving times
+       timeouts, budget: every depth is checked with the first timeout, then the
+       unknown ones are retried with the next timeouts, within the total budget (ms);
+       with handoff a depth still unknown is raced across the solver portfolio for
+       the rest of the budget. Depths the budget left unchecked are not in depths.
+       bound: the goal is checked after start to bound transitions
+       prefix: optional formulas over xns (and fvs) constraining transitions 1, 2, ...
+       count, block: up to count counterexamples of the shortest violated depth, each
+       differing from the previous ones on block = (sequence, keys), two lists of
+       pairs (condition, terms) over xns and fvs: at each step where condition holds
+       in a counterexample, the next one must change one of the terms. With diverse,
+       the further counterexamples first have to differ on sequence alone (e.g.
+       another transaction sequence), then on sequence or keys (e.g. parameters).
+       Solvers and models use the z3 context of trans.
+       Returns a BmcResult.
+    """
+    ctx = trans.ctx
+    u = BmcUnrolling(xs, xns, fvs)
+    result = BmcResult()
+    T0 = time.time()
+    def remaining():
+        return None if budget == None else budget - (time.time() - T0) * 1000
+    def decide(s, timeouts, handoff, *assumptions):
+        '''(None, None) if the budget was spent before s could be checked'''
+        res = None
+        for timeout in timeouts:
+            left = remaining()
+            if left != None and left <= 0:
+                break
+            s.set("timeout", int(timeout if left == None else min(timeout, left)))
+            res = check(s, stats, *assumptions)
+            if res != z3.unknown:
+                return res, (s.model() if res == z3.sat else None)
+        left = remaining()
+        if handoff and (left == None or left > 0):
+            def task(config):
+                sp = make_solver(config, ctx)
+                if left != None:
+                    sp.set("timeout", int(left))
+                sp.add(s.assertions())
+                res = sp.check(*assumptions)
+                return res.__str__(), (encode_model(sp.model()) if res == z3.sat else None)
+            _, res = race(task, configs_for(*s.assertions()), decisive=lambda r: r[0] != 'unknown',
+                          timeout=None if left == None else left / 1000)
+            if res != None:
+                return (z3.sat, decode_model(res[1], ctx)) if res[0] == 'sat' else (z3.unsat, None)
+            res = z3.unknown
+        return res, None
+    s = make_solver(config, ctx)
+    local = is_local(profile)
+    # the formulas added so far, preprocessed if local (s holds them then)
+    formulas = []
+    def add(f):
+        if local:
+            f = preprocess(f, profile, stats)[0]
+            s.add(f)
+        formulas.append(f)
+    add(init)
+    seen = []
+    # depth -> number of formulas its query is over
+    frames = {}
+    def solve_depth(depth, timeouts, handoff=False, retry=False):
+        goal_k = u.at(goal, depth)
+        if local:
+            g = preprocess(goal_k, profile, stats)[0]
+            if retry:
+                # s holds the steps of the later depths too
+                sd, assumptions = make_solver(config, ctx), []
+                sd.add(formulas[:frames[depth]] + [g])
+            else:
+                p = z3.Bool("P@%d" % depth, ctx)
+                s.add(z3.Implies(p, g))
+                sd, assumptions = s, [p]
+            res, m = decide(sd, timeouts, handoff, *assumptions)
+            # print(res)
+            if z3.sat == res and count > 1 and block != None:
+                more_models(sd, assumptions, m, depth, timeouts)
+        else:
+            query = z3.And(formulas[:frames[depth]] + [goal_k])
+            f, g = preprocess(query, profile, stats)
+            sd = make_solver(config, ctx)
+            sd.add(f)
+            res, m = decide(sd, timeouts, handoff)
+            if z3.sat == res:
+                # preprocessing may have eliminated variables the trace is read from
+                m = g.convert_model(complete_model(m, f)) if g != None else m
+                if not z3.is_true(m.eval(query, model_completion=True)):
+                    # the model was not reconstructed (e.g. elim-uncnstr under strings), solve the raw query
+                    sd = make_solver(config, ctx)
+                    sd.add(query)
+                    res, m = decide(sd, timeouts, handoff)
+            if z3.sat == res and count > 1 and block != None:
+                sd = make_solver(config, ctx)
+                sd.add(query)
+                more_models(sd, [], m, depth, timeouts)
+        return res, m
+    def differs(m, depth, pairs):
+        '''a model other than m on the terms of pairs'''
+        lits = []
+        for k in range(1, depth + 1):
+            for condition, terms in pairs:
+                c = u.post(condition, k)
+                if z3.is_true(m.eval(c, model_completion=True)):
+                    lits.append(z3.Not(c))
+                    lits += [u.post(t, k) != m.eval(u.post(t, k), model_completion=True) for t in terms]
+        return z3.Or(lits + [z3.BoolVal(False, ctx)])
+    def more_models(s, assumptions, m, depth, timeouts):
+        result.models = [m]
+        levels = [block[0], block[0] + block[1]] if diverse else [block[0] + block[1]]
+        for pairs in levels:
+            while len(result.models) < count:
+                s.push()
+                s.add([differs(mi, depth, pairs) for mi in result.models])
+                res, mi = decide(s, timeouts, False, *assumptions)
+                s.pop()
+                if res != z3.sat:
+                    break
+                result.models.append(mi)
+    def violated(depth, m):
+        # print(m)
+        result.depths[depth] = 'violated'
+        result.status = 'violated'
+        result.model = m
+        result.depth = depth
+        if result.models == []:
+            result.models = [m]
+        return result
+    # every depth at the first timeout, as a single timeout would
+    unknown = []
     # print("iteration ", end = "")
-    while count<=7:
-        # print(count, end = "", flush=True)
-        count += 1
-        p = fresh(count, z3.BoolSort(), "P")
-        s.add(z3.Implies(p, goal))
-        
-        res = s.check(p)
-        # print(res)
+    for depth in range(bound + 1):
+        # print(depth, end = "", flush=True)
+        if depth >= start:
+            frames[depth] = len(formulas)
+            res, m = solve_depth(depth, timeouts[:1])
+            if res == None:
+                break
+            if z3.sat == res:
+                return violated(depth, m)
+            elif z3.unsat == res:
+                result.depths[depth] = 'proved'
+            else:
+                result.depths[depth] = 'inconclusive'
+                unknown.append(depth)
+        k = depth + 1
+        add(u.step(trans, k))
+        if prefix and k <= len(prefix):
+            add(u.post(prefix[k-1], k))
+        if commute and k >= 3:
+            # transitions k-2 and k-1 are no longer the last pair
+            for first, second in commute:
+                add(z3.Not(z3.And(u.post(first, k-2), u.post(second, k-1))))
+        for v, taken in symmetric or []:
+            a = u.post(v, k)
+            t = u.post(taken, k)
+            old = z3.Or([z3.And(tb, a == b) for b, tb in seen], ctx)
+            new = z3.And([z3.Implies(tb, greater(a, b)) for b, tb in seen], ctx)
+            add(z3.Implies(t, z3.Or(old, new)))
+            seen.append((a, t))
+    # then the unknown ones again with the longer timeouts, within what is left of the budget
+    for depth in unknown:
+        res, m = solve_depth(depth, timeouts[1:], handoff, True)
+        if res == None:
+            break
         if z3.sat == res:
-            # print(s.model())
-            return s.model()
-        s.add(trans)
-        ys = [fresh(count, x.sort(), pure_name(x.__str__())) for x in xs]
-        nfvs = [fresh(count, x.sort(), pure_name(x.__str__())) for x in fvs]
-        # print("before:", trans)
-        trans = z3.substitute(trans, 
-                           zipp(xns + xs + fvs, ys + xns + nfvs))
-        # print("zip:", zipp(xns + xs + fvs, ys + xns + nfvs))
-        # print("after:", trans)
-        goal = z3.substitute(goal, zipp(xs, xns))
-        xs, xns, fvs = xns, ys, nfvs
-        # sys.stdout.flush()
-
-def extract_model(model, var=None):
-    rd = {}
-    maxrd = -1
-    for v in model:
-        name = v.__str__()
-        if "|" in name:
-            round = int(name[name.index("|r")+2:name.index("|i")]) + 1
-            maxrd = max(maxrd, round)
-            index = int(name[name.index("|i")+2:])
-            pname = pure_name(name)
-            # print(pname, pname[-1])
-            if pname[-1] == "'":
-                pname = pname[:-1]
-            # print(pname)
-            if round not in rd.keys():
-                rd[round] = {}
-            rd[round][pname] = model[v]
-            # print(round, index)
+            return violated(depth, m)
+        elif z3.unsat == res:
+            result.depths[depth] = 'proved'
+    if any(result.depths.get(depth) != 'proved' for depth in range(start, bound + 1)):
+        result.status = 'inconclusive'
+    return result
+
+def portfolio_bmc(init, trans, goal, fvs, xs, xns, commute=None, symmetric=None, configs=None, benchmark=None, profile=None,
+                  timeouts=TIMEOUTS, budget=BUDGET, bound=BOUND):
+    '''Races bmc under several solver configurations in separate processes and
+       returns the BmcResult of the first one that is not inconclusive. The winner
+       is recorded for benchmark so that later runs can default to it.
+    '''
+    configs = configs or configs_for(init, trans, goal)
+    def task(config):
+        result = bmc(init, trans, goal, fvs, xs, xns, commute=commute, symmetric=symmetric, config=config, profile=profile,
+                     timeouts=timeouts, budget=budget, bound=bound)
+        if result.model != None:
+            result.model = encode_model(result.model)
+        # a single counterexample is asked for, and models are not picklable
+        result.models = []
+        return result
+    config, result = race(task, configs, decisive=lambda r: r.status != 'inconclusive')
+    if result == None:
+        result = BmcResult()
+        result.status = 'inconclusive'
+        return result
+    if benchmark != None:
+        record_winner(benchmark, config)
+    if result.model != None:
+        result.model = decode_model(result.model, trans.ctx)
+    return result
+
+def cube_bmc(init, trans, goal, fvs, xs, xns, cubes, commute=None, symmetric=None, config=None, profile=None,
+             timeouts=TIMEOUTS, budget=BUDGET, bound=BOUND, workers=None, cube_budget=CUBE_BUDGET):
+    '''Cube-and-conquer bmc. cubes are prefixes of the same length L (formulas over
+       xns and fvs fixing transitions 1..L, e.g. which transaction is called); depths
+       below L are checked first, then every cube is checked from depth L to bound in
+       a separate process, at most workers at a time, each within cube_budget (ms),
+       all within budget (ms). The first violated cube stops the others, so the
+       counterexample returned is not necessarily the shortest one. A depth from L on
+       is proved when every cube proved it, else inconclusive (the depths the
+       counterexample is longer than included). workers defaults to the number of
+       cores.
+    '''
+    T0 = time.time()
+    def remaining():
+        return None if budget == None else budget - (time.time() - T0) * 1000
+    if not cubes:
+        return bmc(init, trans, goal, fvs, xs, xns, commute=commute, symmetric=symmetric, config=config, profile=profile,
+                   timeouts=timeouts, budget=budget, bound=bound)
+    length = len(cubes[0])
+    result = bmc(init, trans, goal, fvs, xs, xns, commute=commute, symmetric=symmetric, config=config, profile=profile,
+                 timeouts=timeouts, budget=budget, bound=min(length, bound + 1) - 1)
+    if result.status == 'violated' or length > bound:
+        return result
+    def task(i):
+        left = remaining()
+        r = bmc(init, trans, goal, fvs, xs, xns, commute=commute, symmetric=symmetric, config=config, profile=profile,
+                timeouts=timeouts, budget=cube_budget if left == None else min(cube_budget, left), bound=bound,
+                prefix=cubes[i], start=length)
+        if r.model != None:
+            r.model = encode_model(r.model)
+        r.models = []
+        return r
+    results = []
+    left = remaining()
+    _, found = race(task, list(range(len(cubes))), decisive=lambda r: r.status == 'violated', workers=workers or os.cpu_count(),
+                    timeout=None if left == None else max(left, 0) / 1000, results=results)
+    last = bound
+    if found != None:
+        last = found.depth - 1
+        result.status = 'violated'
+        result.model = decode_model(found.model, trans.ctx)
+        result.models = [result.model]
+        result.depth = found.depth
+        result.depths[found.depth] = 'violated'
+    for depth in range(length, last + 1):
+        # a depth proved in some cubes only is not proved
+        if len(results) == len(cubes) and all(r.depths.get(depth) == 'proved' for _, r in results):
+            result.depths[depth] = 'proved'
         else:
-            if name[-1] == "'":
-                if 1 not in rd.keys():
-                    rd[1] = {}
-                rd[1][name[:-1]] = model[v]
-            else:
-                if 0 not in rd.keys():
-                    rd[0] = {}
-                rd[0][name] = model[v]
-    # print(rd)
-    # for i in range(maxrd-1):
-    #     print("round {i}:".format(i=i))
-    #     if var == None:
-    #         print(rd[i])
-    #     else:
-    #         if var in rd[i].keys():
-    #             print(rd[i][var])
-    #         else:
-    #             print(rd[i][var+"'"])
-    return rd
\ No newline at end of file
+            result.depths[depth] = 'inconclusive'
+            if found == None:
+                result.status = 'inconclusive'
+    return result
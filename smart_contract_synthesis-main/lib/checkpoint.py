@@ -0,0 +1,72 @@
+'''Checkpoints of a cegis run, written in the format of lib.vmt: a JSON header
+(observation tables, negative traces, candidate guards, properties, hypothesis,
+counters) referring by index to the SMT-LIB terms that follow it.
+
+cegis writes one every INTERVAL seconds and when it stops, to the path given
+or to <name>.smt2 in the directory CEGIS_CHECKPOINT_DIR, and resumes from it
+when it exists.
+'''
+import os
+from lib.vmt import Writer, read
+
+# seconds between two checkpoints of a cegis run
+INTERVAL = 60
+
+def path_for(name, path=None):
+    '''path, or the checkpoint of the contract name in CEGIS_CHECKPOINT_DIR, or None'''
+    if path == None and os.environ.get("CEGIS_CHECKPOINT_DIR"):
+        path = os.path.join(os.environ["CEGIS_CHECKPOINT_DIR"], name + ".smt2")
+    return path
+
+def write_rows(w, rows):
+    '''Traces and observation tables: lists of (transition name, terms...)'''
+    return [[[step[0]] + [w.ref(e) for e in step[1:]] for step in row] for row in rows]
+
+def read_rows(rows, terms):
+    return [[[step[0]] + [terms[e] for e in step[1:]] for step in row] for row in rows]
+
+def save(path, statemachine, state):
+    '''state: dict of pos and neg (observation tables), ntraces (negative traces),
+       candidate_guard (tr -> list of predicates), properties and plain values
+       (hypothesis, best, level, counters). The file is replaced atomically, its
+       directory created if missing.
+    '''
+    w = Writer()
+    header = dict(state, kind='checkpoint', name=statemachine.name, transitions=statemachine.transitions,
+                  pos=write_rows(w, state['pos']), neg=write_rows(w, state['neg']),
+                  ntraces=write_rows(w, state['ntraces']),
+                  candidate_guard={t: [w.ref(g) for g in state['candidate_guard'][t]] for t in state['candidate_guard']},
+                  properties=[w.ref(p) for p in state['properties']])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", 'w') as f:
+        f.write(w.text(header, []))
+    os.replace(path + ".tmp", path)
+
+def load(path, ctx=None):
+    '''The state saved by save, its terms in z3 context ctx'''
+    header, terms = read(path, ctx)
+    assert header['kind'] == 'checkpoint', "%s is not a cegis checkpoint" % path
+    state = dict(header)
+    del state['terms']
+    for k in ('pos', 'neg', 'ntraces'):
+        state[k] = read_rows(header[k], terms)
+    state['ntraces'] = [[tuple(step) for step in trace] for trace in state['ntraces']]
+    state['candidate_guard'] = {t: [terms[g] for g in gs] for t, gs in header['candidate_guard'].items()}
+    state['properties'] = [terms[p] for p in header['properties']]
+    return state
+
+def restore(path, statemachine, properties, resume=True, warm_start=None):
+    '''(state, warm): the state saved at path to resume from, if it exists, with
+       resume, and is of the same specification (statemachine.fingerprint); and
+       the state of warm_start, or of path if the specification changed, to warm
+       start from. Each None if there is none.
+    '''
+    if warm_start != None:
+        return None, load(warm_start, statemachine.ctx)
+    if path == None or not resume or not os.path.exists(path):
+        return None, None
+    state = load(path, statemachine.ctx)
+    if state.get('model') != statemachine.fingerprint(properties):
+        print("specification changed since checkpoint %s, warm start" % path)
+        return None, state
+    return state, None
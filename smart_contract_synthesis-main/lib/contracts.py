@@ -0,0 +1,31 @@
+import runpy
+import threading
+from lib.state_machine import loading
+from lib.expr_utils import translate
+
+# scripts build in the main z3 context, loaded one at a time
+_lock = threading.RLock()
+
+def load(path, ctx=None):
+    '''Runs an input/*.py contract script without its final cegis call, or reads
+       a model written by lib.vmt (*.vmt).
+       Returns (statemachine, properties, positive_traces, candidate_guard), in
+       z3 context ctx if given (scripts build in the main context and are translated)
+    '''
+    if path.endswith('.vmt'):
+        import lib.vmt
+        return lib.vmt.load(path, ctx)
+    with _lock:
+        # cegis only records its arguments in this thread while the script runs
+        captured = []
+        outer = getattr(loading, 'calls', None)
+        loading.calls = captured
+        try:
+            runpy.run_path(path)
+        finally:
+            loading.calls = outer
+        statemachine, properties, positive_traces, candidate_guard = captured[-1]
+        if ctx != None:
+            statemachine = statemachine.translate(ctx)
+            properties, positive_traces, candidate_guard = translate((properties, positive_traces, candidate_guard), ctx)
+        return statemachine, properties, positive_traces, candidate_guard
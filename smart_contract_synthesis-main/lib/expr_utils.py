@@ -0,0 +1,104 @@
+import z3
+import threading
+from collections import OrderedDict
+
+# number of expressions whose subterms are kept by subterms()
+CACHE_SIZE = 1024
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def expr(e, ctx=None):
+    '''e as a z3 expression (python booleans, e.g. a guard given as True, become BoolVal)'''
+    return z3.BoolVal(e, ctx) if isinstance(e, bool) else e
+
+def translate(x, ctx):
+    '''x in the z3 context ctx, where x is an expression (or sort, model) or a list,
+       tuple or dict of them; other values are returned unchanged
+    '''
+    if isinstance(x, (z3.AstRef, z3.ModelRef)):
+        return x if x.ctx == ctx else x.translate(ctx)
+    if isinstance(x, (list, tuple)):
+        return type(x)(translate(v, ctx) for v in x)
+    if isinstance(x, dict):
+        return type(x)((k, translate(v, ctx)) for k, v in x.items())
+    return x
+
+def subterms(e):
+    '''Ids of the distinct subterms of e, and its constants by name. Each shared
+       subterm is visited once; the results for the last CACHE_SIZE expressions are
+       kept, together with the expression itself so that its id is not reused.
+
+    >>> x, y = z3.Ints('x y')
+    >>> ids, consts = subterms(z3.And(x + y > 0, x + y < 5))
+    >>> len(ids), sorted(consts)
+    (8, ['x', 'y'])
+    '''
+    e = expr(e)
+    key = (id(e.ctx), e.get_id())
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key][1]
+    ids = set()
+    consts = {}
+    todo = [e]
+    while todo:
+        t = todo.pop()
+        if t.get_id() in ids:
+            continue
+        ids.add(t.get_id())
+        if z3.is_quantifier(t):
+            todo.append(t.body())
+        elif z3.is_const(t):
+            if t.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                consts[t.__str__()] = t
+        else:
+            todo.extend(t.children())
+    with _lock:
+        _cache[key] = (e, (ids, consts))
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return ids, consts
+
+def free_vars(e):
+    '''The uninterpreted constants of e'''
+    return set(subterms(e)[1].values())
+
+def constant_names(e):
+    '''Names of the uninterpreted constants of e'''
+    return set(subterms(e)[1])
+
+def contains(x, e):
+    '''Whether x is a subterm of e'''
+    return expr(x).get_id() in subterms(e)[0]
+
+def conjuncts(e):
+    '''The conjuncts of e, nested conjunctions flattened'''
+    e = expr(e)
+    if z3.is_and(e):
+        return [c for arg in e.children() for c in conjuncts(arg)]
+    return [e]
+
+def dag_size(e):
+    '''Number of distinct subterms of e'''
+    return len(subterms(e)[0])
+
+def tree_size(e):
+    '''Number of nodes of e printed as a tree, i.e. with shared subterms repeated'''
+    sizes = {}
+    def size(t):
+        if t.get_id() not in sizes:
+            children = [t.body()] if z3.is_quantifier(t) else t.children()
+            sizes[t.get_id()] = 1 + sum(size(c) for c in children)
+        return sizes[t.get_id()]
+    return size(expr(e))
+
+def depth(e):
+    '''Length of the longest path from e to a leaf'''
+    depths = {}
+    def d(t):
+        if t.get_id() not in depths:
+            children = [t.body()] if z3.is_quantifier(t) else t.children()
+            depths[t.get_id()] = 1 + max([d(c) for c in children], default=0)
+        return depths[t.get_id()]
+    return d(expr(e))
@@ -0,0 +1,90 @@
+import multiprocessing
+from multiprocessing.connection import wait
+
+class ForkServer(object):
+    '''Worker processes forked once the model is built: they inherit it (and
+       handler, which may close over it) copy-on-write, so jobs and results are
+       plain picklable values and no z3 object is rebuilt or pickled. The workers
+       are not daemons, so handler may race processes itself (portfolio, cubes).
+       Each worker has its own pipe, so the job of a worker that dies is known.
+    '''
+    def __init__(self, handler, workers=None):
+        self.handler = handler
+        self.workers = workers or multiprocessing.cpu_count()
+        self.ctx = multiprocessing.get_context('fork')
+        self.processes = []
+        self.conns = []
+        self.start()
+
+    def start(self):
+        for _ in range(self.workers):
+            self.processes.append(None)
+            self.conns.append(None)
+            self.fork(len(self.processes) - 1)
+
+    def fork(self, w):
+        '''(Re)starts worker w'''
+        conn, child = self.ctx.Pipe()
+        self.processes[w] = self.ctx.Process(target=self.serve, args=(child,))
+        self.processes[w].start()
+        child.close()
+        self.conns[w] = conn
+
+    def serve(self, conn):
+        while True:
+            job = conn.recv()
+            if job == None:
+                return
+            try:
+                result = self.handler(job)
+            except Exception:
+                result = None
+            conn.send(result)
+
+    def map(self, jobs):
+        '''handler(job) for each job, in order; None for a job whose handler raised
+           or whose worker died (that worker is forked again, the other jobs go on)
+        '''
+        results = [None] * len(jobs)
+        pending = list(range(len(jobs)))
+        idle = list(range(len(self.processes)))
+        # worker -> index of the job it runs
+        assigned = {}
+        while pending or assigned:
+            while pending and idle:
+                w = idle.pop(0)
+                i = pending.pop(0)
+                self.conns[w].send(jobs[i])
+                assigned[w] = i
+            wait([self.conns[w] for w in assigned] + [self.processes[w].sentinel for w in assigned])
+            for w in list(assigned):
+                try:
+                    if not self.conns[w].poll():
+                        if self.processes[w].is_alive():
+                            continue
+                        raise EOFError
+                    results[assigned.pop(w)] = self.conns[w].recv()
+                except (EOFError, OSError):
+                    # died with the job
+                    assigned.pop(w, None)
+                    self.conns[w].close()
+                    self.processes[w].join()
+                    self.fork(w)
+                idle.append(w)
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for p in self.processes:
+            p.join(timeout=1)
+            if p.is_alive():
+                p.kill()
+                p.join()
+        for conn in self.conns:
+            conn.close()
+        self.processes = []
+        self.conns = []
@@ -0,0 +1,178 @@
+import z3
+import os
+import json
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from lib.expr_utils import free_vars
+
+# Named solver configurations. 'tactic' builds the solver from a tactic chain,
+# every other key is a solver parameter.
+CONFIGS = {
+    'default': {},
+    'seed1': {'smt.random_seed': 1},
+    'seed2': {'smt.random_seed': 2},
+    'no-relevancy': {'smt.relevancy': 0},
+    'array-no-ext': {'smt.array.extensional': False},
+    'array-weak': {'smt.array.weak': True},
+    'bitblast': {'tactic': ['simplify', 'solve-eqs', 'bit-blast', 'sat']},
+}
+
+# configurations that only decide quantifier-free bit-vector formulas
+BV_ONLY = ['bitblast']
+
+# file of the output directory (CEGIS_OUTPUT_DIR) recording the winning
+# configuration of each benchmark
+WINNERS = 'portfolio_winners.json'
+
+def path_for(name, path=None):
+    '''path, or the file name in the output directory CEGIS_OUTPUT_DIR, or None'''
+    if path == None and os.environ.get("CEGIS_OUTPUT_DIR"):
+        path = os.path.join(os.environ["CEGIS_OUTPUT_DIR"], name)
+    return path
+
+def pure_bv(*formulas):
+    '''Whether the formulas are quantifier-free over booleans and bit-vectors'''
+    seen = set()
+    todo = list(formulas)
+    while todo:
+        t = todo.pop()
+        if t.get_id() in seen:
+            continue
+        seen.add(t.get_id())
+        if z3.is_quantifier(t) or not (z3.is_bool(t) or z3.is_bv(t)):
+            return False
+        todo.extend(t.children())
+    return True
+
+def configs_for(*formulas):
+    '''The configurations worth racing on a query made of formulas'''
+    bv = pure_bv(*formulas)
+    return [c for c in CONFIGS if bv or c not in BV_ONLY]
+
+def make_solver(config=None, ctx=None):
+    options = dict(CONFIGS[config or 'default'])
+    tactic = options.pop('tactic', None)
+    if tactic != None:
+        s = z3.Then(*tactic, ctx=ctx).solver()
+    else:
+        s = z3.Solver(ctx=ctx)
+    for k, v in options.items():
+        s.set(k, v)
+    return s
+
+def race(task, jobs, decisive=None, workers=None, timeout=None, results=None):
+    '''Runs task(job) for each job in a forked process, at most workers at a time.
+       Returns (job, result) for the first result accepted by decisive (any result
+       if decisive is None) and kills the remaining processes, or (None, None).
+       Results must be picklable; a task raising an exception yields no result.
+       Every (job, result) received is appended to results if given. Each process
+       has its own pipe, so a result sent before the process exits is not lost.
+    '''
+    ctx = multiprocessing.get_context('fork')
+    def run(conn, job):
+        try:
+            result = task(job)
+        except Exception:
+            result = None
+        try:
+            conn.send(result)
+        except Exception:
+            # not picklable, nothing was written
+            conn.send(None)
+    workers = workers or len(jobs)
+    deadline = None if timeout == None else time.time() + timeout
+    pending = list(enumerate(jobs))
+    # job index -> (process, pipe end the result is read from)
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                i, job = pending.pop(0)
+                conn, child = ctx.Pipe(duplex=False)
+                running[i] = (ctx.Process(target=run, args=(child, job), daemon=True), conn)
+                running[i][0].start()
+                child.close()
+            left = None if deadline == None else deadline - time.time()
+            if left != None and left <= 0:
+                break
+            wait([conn for p, conn in running.values()] + [p.sentinel for p, conn in running.values()], left)
+            for i in list(running):
+                p, conn = running[i]
+                # the pipe first: a process may exit right after sending
+                if conn.poll():
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        # died without reporting
+                        result = None
+                elif p.is_alive():
+                    continue
+                else:
+                    result = None
+                running.pop(i)
+                conn.close()
+                p.join()
+                if results != None and result != None:
+                    results.append((jobs[i], result))
+                if result != None and (decisive == None or decisive(result)):
+                    return jobs[i], result
+    finally:
+        for p, conn in running.values():
+            p.kill()
+            p.join()
+            conn.close()
+    return None, None
+
+def load_winners(path=None):
+    path = path_for(WINNERS, path)
+    if path == None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def record_winner(benchmark, config, path=None):
+    '''Counts a race won by config for benchmark, if there is an output directory'''
+    path = path_for(WINNERS, path)
+    if path == None:
+        return
+    winners = load_winners(path)
+    counts = winners.setdefault(benchmark, {})
+    counts[config] = counts.get(config, 0) + 1
+    with open(path, 'w') as f:
+        json.dump(winners, f, indent=2, sort_keys=True)
+
+def historical_winner(benchmark, path=None):
+    '''The configuration that won most races for benchmark, None if never raced'''
+    counts = load_winners(path).get(benchmark)
+    if not counts:
+        return None
+    return max(counts, key=counts.get)
+
+def encode_model(model):
+    '''Picklable form of a model: (name, value sort, value) SMT-LIB triples'''
+    return [(d.name(), model[d].sort().sexpr(), model[d].sexpr()) for d in model.decls() if d.arity() == 0]
+
+def decode_model(entries, ctx=None):
+    '''Rebuilds a model from encode_model entries in context ctx, skipping values
+       that cannot be parsed back (e.g. arrays given as references to auxiliary functions)
+    '''
+    s = z3.Solver(ctx=ctx)
+    for name, sort, value in entries:
+        try:
+            eq = z3.parse_smt2_string("(declare-const v %s)(assert (= v %s))" % (sort, value), ctx=ctx)[0]
+        except z3.Z3Exception:
+            continue
+        s.add(z3.Const(name, eq.arg(1).sort()) == eq.arg(1))
+    s.check()
+    return s.model()
+
+def encode_trace(trace):
+    '''Picklable form of a counterexample trace [(tr, formula, ...), ...]: the
+       formulas as SMT-LIB assertions with the declarations of their constants
+    '''
+    return [(rule[0], [''.join("(declare-const %s %s)" % (v.sexpr(), v.sort().sexpr()) for v in free_vars(e)) +
+                       "(assert %s)" % e.sexpr() for e in rule[1:]]) for rule in trace]
+
+def decode_trace(entries, ctx=None):
+    return [tuple([tr] + [z3.parse_smt2_string(text, ctx=ctx)[0] for text in formulas]) for tr, formulas in entries]
@@ -0,0 +1,85 @@
+import z3
+import os
+import json
+import time
+from lib.portfolio import path_for
+
+# Named preprocessing profiles: tactic chains applied before solving
+PROFILES = {
+    'none': [],
+    'simplify': ['simplify'],
+    'propagate': ['simplify', 'propagate-values'],
+    'solve-eqs': ['simplify', 'propagate-values', 'solve-eqs'],
+    'full': ['simplify', 'propagate-values', 'solve-eqs', 'elim-uncnstr'],
+    'bit-blast': ['simplify', 'propagate-values', 'solve-eqs', 'elim-uncnstr', 'bit-blast'],
+}
+
+# Tactics whose result is equivalent to their input over the same variables.
+# Profiles made only of these are applied frame by frame in an incremental BMC,
+# the others eliminate or introduce variables and are applied to whole queries.
+LOCAL = ['simplify', 'propagate-values', 'ctx-simplify']
+
+# file of the output directory (CEGIS_OUTPUT_DIR) storing the profile chosen for
+# each contract
+CONTRACT_PROFILES = 'tactic_profiles.json'
+
+def is_local(profile):
+    return all(t in LOCAL for t in PROFILES[profile or 'none'])
+
+def new_stats():
+    return {'preprocess': 0.0, 'solve': 0.0, 'queries': 0, 'failed': 0}
+
+def preprocess(f, profile, stats=None):
+    '''Applies the tactics of profile to f. Returns the preprocessed formula and
+       the goal to convert its models back with (None if nothing was applied).
+       A failing tactic leaves f unchanged and is counted in stats['failed'].
+    '''
+    tactics = PROFILES[profile or 'none']
+    if tactics == []:
+        return f, None
+    T1 = time.time()
+    g = z3.Goal(ctx=f.ctx)
+    g.add(f)
+    try:
+        tactic = z3.Then(*tactics, ctx=f.ctx) if len(tactics) > 1 else z3.Tactic(tactics[0], ctx=f.ctx)
+        result = tactic(g)
+        assert len(result) == 1
+        goal = result[0]
+        f = goal.as_expr()
+    except z3.Z3Exception:
+        goal = None
+        if stats != None:
+            stats['failed'] += 1
+    if stats != None:
+        stats['preprocess'] += time.time() - T1
+    return f, goal
+
+def check(s, stats=None, *assumptions):
+    '''s.check(*assumptions), accounting its time in stats'''
+    T1 = time.time()
+    result = s.check(*assumptions)
+    if stats != None:
+        stats['solve'] += time.time() - T1
+        stats['queries'] += 1
+    return result
+
+def load_profiles(path=None):
+    path = path_for(CONTRACT_PROFILES, path)
+    if path == None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_profile(name, profile, path=None):
+    '''Stores the profile of contract name, if there is an output directory'''
+    path = path_for(CONTRACT_PROFILES, path)
+    if path == None:
+        return
+    profiles = load_profiles(path)
+    profiles[name] = profile
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+def profile_for(name, path=None):
+    '''The profile stored for contract name, None if there is none'''
+    return load_profiles(path).get(name)
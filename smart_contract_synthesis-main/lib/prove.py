@@ -1,21 +1,6 @@
 import z3
-
-# Wrapper for allowing Z3 ASTs to be stored into Python Hashtables. 
-def askey(n):
-    assert isinstance(n, z3.AstRef)
-    return n
-
-def get_vars(f):
-    r = set()
-    def collect(f):
-      if z3.is_const(f): 
-          if f.decl().kind() == z3.Z3_OP_UNINTERPRETED and not askey(f) in r:
-              r.add(askey(f))
-      else:
-          for c in f.children():
-              collect(c)
-    collect(f)
-    return r
+from lib.portfolio import configs_for, make_solver, race, record_winner
+from lib.preprocess import preprocess, is_local, check
 
 def get_clause(body,head):
     # all_vars = list(get_vars(body))
@@ -23,18 +8,107 @@ def get_clause(body,head):
     return z3.Implies(body, head)
 
 
-def prove(f):
-    s = z3.Solver()
-    s.add(z3.Not(f))
-    result = s.check()
+def prove(f, config=None, profile=None, stats=None):
+    s = make_solver(config, f.ctx)
+    vc, g = preprocess(z3.Not(f), profile, stats)
+    s.add(vc)
+    result = check(s, stats)
     if result == z3.unsat:
         print ("proved")
     else:
         print ("failed to prove: ", result)
         print (f)
-        print (s.model())
+        if result == z3.sat:
+            print (g.convert_model(s.model()) if g != None else s.model())
     return s
 
+def portfolio_prove(f, configs=None, benchmark=None):
+    '''Races the proof of f under several solver configurations in separate
+       processes. Returns 'proved', 'failed' or 'unknown' if no configuration
+       gives a definitive answer.
+    '''
+    configs = configs or configs_for(f)
+    def task(config):
+        s = make_solver(config, f.ctx)
+        s.add(z3.Not(f))
+        result = s.check()
+        if result == z3.unsat:
+            return 'proved'
+        return 'failed' if result == z3.sat else 'unknown'
+    config, result = race(task, configs, decisive=lambda r: r != 'unknown')
+    if result == None:
+        return 'unknown'
+    if benchmark != None:
+        record_winner(benchmark, config)
+    return result
+
+class ProofResult(object):
+    '''Outcome of one verification condition: status is 'proved', 'failed' or
+       'unknown'; counterexample() gives the model refuting a failed one.
+    '''
+    def __init__(self, name, vc, status, model=None, goal=None):
+        self.name = name
+        self.vc = vc
+        self.status = status
+        self._model = model
+        self._goal = goal
+
+    def counterexample(self):
+        if self._model == None:
+            return None
+        return self._goal.convert_model(self._model) if self._goal != None else self._model
+
+    def __repr__(self):
+        return 'ProofResult(%s, %s)' % (self.name, self.status)
+
+class Prover(object):
+    '''Discharges verification conditions against a shared context (e.g. Tr and
+       lemmas). The context is asserted once, each VC is checked under its own
+       assumption literal which is retired afterwards. ctx is the z3 context, by
+       default the one of the shared context formulas.
+
+    >>> x, x_out = z3.Ints("x x'")
+    >>> p = Prover([x_out == x + 1])
+    >>> p.prove(z3.Implies(x > 0, x_out > 0), 'step')
+    ProofResult(step, proved)
+    >>> r = p.prove(x_out > 0)
+    >>> r.status, r.counterexample().eval(x_out).as_long() <= 0
+    ('failed', True)
+    '''
+    def __init__(self, context=[], config=None, profile=None, stats=None, printing=False, ctx=None):
+        self.ctx = ctx if ctx != None else (context[0].ctx if context else z3.main_ctx())
+        self.solver = make_solver(config, self.ctx)
+        for f in context:
+            self.solver.add(f)
+        # preprocessing the VC alone is only sound if it keeps every variable
+        self.profile = profile if is_local(profile) else None
+        self.stats = stats
+        self.printing = printing
+        self.count = 0
+
+    def prove(self, f, name=None):
+        vc, g = preprocess(z3.Not(f), self.profile, self.stats)
+        p = z3.Bool("vc!%d" % self.count, self.ctx)
+        self.count += 1
+        self.solver.add(z3.Implies(p, vc))
+        result = check(self.solver, self.stats, p)
+        model = self.solver.model() if result == z3.sat else None
+        self.solver.add(z3.Not(p))
+        status = 'proved' if result == z3.unsat else ('failed' if result == z3.sat else 'unknown')
+        res = ProofResult(name if name != None else p.__str__(), f, status, model, g)
+        if self.printing:
+            if status == 'proved':
+                print ("proved")
+            else:
+                print ("failed to prove: ", result)
+                print (f)
+                if model != None:
+                    print (res.counterexample())
+        return res
+
+    def prove_all(self, fs):
+        return [self.prove(f) for f in fs]
+
 def prove_inductive(_ts, _property, lemma = None):
     # The verification conitions from TS.
     f1 = get_clause(_ts.Init, _property)
@@ -47,3 +121,21 @@ def prove_inductive(_ts, _property, lemma = None):
     print ("Prove property is inductive.")
     s = prove(f2)
     return s
+
+def prove_inductive_all(_ts, properties, lemma = None, printing = False):
+    '''prove_inductive for a list of properties with one Prover for the initial
+       states and one for Tr (and lemma). Returns a pair of ProofResults (init,
+       step) per property.
+    '''
+    init = Prover([_ts.Init], printing=printing, ctx=_ts.ctx)
+    step = Prover([_ts.Tr] + ([lemma] if lemma != None else []), printing=printing, ctx=_ts.ctx)
+    results = []
+    for p in properties:
+        if printing:
+            print ("Prove init => property.")
+        r1 = init.prove(p, "init")
+        if printing:
+            print ("Prove property is inductive.")
+        r2 = step.prove(get_clause(p, _ts.to_post(p)), "step")
+        results.append((r1, r2))
+    return results
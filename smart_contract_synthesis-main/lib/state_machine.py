@@ -1,16 +1,186 @@
-from lib.bmc import extract_model
+from lib.bmc import BmcUnrolling, BOUND, BUDGET, zipp
+from lib.portfolio import historical_winner, encode_trace, decode_trace
+from lib.pool import ForkServer
+from lib.preprocess import profile_for
+from lib.expr_utils import expr, contains, constant_names, conjuncts, translate
 from lib.ts import Ts
+import lib.checkpoint
+import lib.templates
 import z3
+import os
+import copy
+import hashlib
 import itertools
+import random
+import threading
 import time
 
-def contains(x, e):
-    return x.__repr__() == e.__repr__() or any([contains(x, c) for c in e.children()])
+def array_root(a):
+    while z3.is_select(a) or z3.is_store(a):
+        a = a.arg(0)
+    return a
+
+def index_uses(e, indexed, plain):
+    '''Collects the index expressions of every array (by root) into indexed and
+       the constants occurring outside of an index position into plain
+    '''
+    if z3.is_quantifier(e):
+        index_uses(e.body(), indexed, plain)
+    elif z3.is_select(e) or z3.is_store(e):
+        root = array_root(e)
+        indexed.setdefault(root.__str__(), []).append(e.arg(1))
+        index_uses(e.arg(0), indexed, plain)
+        if not z3.is_const(e.arg(1)):
+            index_uses(e.arg(1), indexed, plain)
+        for c in e.children()[2:]:
+            index_uses(c, indexed, plain)
+    elif z3.is_const(e):
+        plain.add(e.__str__())
+    else:
+        for c in e.children():
+            index_uses(c, indexed, plain)
+
+def check_preferring(s, assumptions):
+    '''s.check() under as many of the assumptions as consistent: those of each
+       unsat core are dropped in turn
+    '''
+    result = s.check(*assumptions)
+    while result == z3.unsat and s.unsat_core():
+        core = set(c.get_id() for c in s.unsat_core())
+        assumptions = [a for a in assumptions if a.get_id() not in core]
+        result = s.check(*assumptions)
+    return result if result != z3.unsat else s.check()
+
+def ddmin(items, test):
+    '''Delta debugging: a 1-minimal sublist of items (order kept) passing test,
+       items itself if it does not pass
+    '''
+    if not test(items):
+        return items
+    n = 2
+    while len(items) >= 2:
+        size = -(-len(items) // n)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        for i in range(len(chunks)):
+            if test(chunks[i]):
+                items, n = chunks[i], 2
+                break
+            rest = [x for chunk in chunks[:i] + chunks[i + 1:] for x in chunk]
+            if len(chunks) > 2 and test(rest):
+                items, n = rest, max(n - 1, 2)
+                break
+        else:
+            if n >= len(items):
+                break
+            n = min(len(items), 2 * n)
+    return items
+
+class CegisResult(object):
+    """Outcome of a CEGIS run.
+
+    status is 'verified' (no counterexample up to the bound), 'inconclusive' (no
+    counterexample, some property unknown), 'unrealizable' (no candidate guards
+    exclude the counterexamples), or why the run stopped early: 'deadline',
+    'synthesis timeout' or 'max_iters'. hypothesis and guards are those of the best
+    hypothesis verified, with the properties it verified, failed and left unknown.
+    iterations_saved: iterations fewer than the last run without guard templates.
+    """
+    def __init__(self, status, iterations, synthesis_time, verification_time, time):
+        self.status = status
+        self.hypothesis = None
+        self.guards = {}
+        self.verified = []
+        self.failing = []
+        self.inconclusive = []
+        self.iterations = iterations
+        self.iterations_saved = None
+        self.synthesis_time = synthesis_time
+        self.verification_time = verification_time
+        self.time = time
+
+    def __repr__(self):
+        return 'CegisResult(%s, %d verified, %d failing, %d inconclusive, %d iterations)' % (
+            self.status, len(self.verified), len(self.failing), len(self.inconclusive), self.iterations)
+
+# loading.calls, set by lib.contracts.load in the thread running a contract script,
+# collects the arguments of its cegis calls instead of synthesizing
+loading = threading.local()
+
+# statuses of a run that is over, not resumed from its checkpoint
+FINAL = ('verified', 'inconclusive', 'unrealizable')
+
+class CegisOptions(object):
+    """Options of smart_contract_state_machine.cegis, also given to it as keyword
+    arguments.
+
+    abstract_arrays, por, symmetry, portfolio, cubes: how bmc verifies (see bmc),
+    up to depth transitions; adaptive verifies at the bounds of depth_schedule
+    in turn, deepening once a hypothesis survives the current one.
+    workers: verify the properties in parallel in that many processes forked
+    once the candidates are built (jobs are property and hypothesis indices);
+    without, the processes solving the cubes of a property (all cores by default).
+    deadline: wall-clock budget (s) of the whole run, CEGIS_DEADLINE by default;
+    synthesis_budget, verification_budget: budget (s) of one synthesis and of one
+    verification of all the properties; max_iters: cap on the iterations.
+    Stopped early, the guards are those of the best hypothesis verified so far.
+    checkpoint: file the state of the run is saved to (see lib.checkpoint), and
+    with resume continued from if it exists (the result of a run that finished
+    is returned without running again). warm_start: checkpoint of a run on
+    an edited specification (the checkpoint itself if its fingerprint differs),
+    whose negative traces still valid seed neg and whose final hypothesis is
+    preferred by the first synthesis.
+    templates: guard template library (see lib.templates, CEGIS_TEMPLATES by
+    default) proposing the guards preferred by the first synthesis of a new run,
+    and recording the guards verified.
+    minimize: shorten each counterexample (minimize_trace) before it is simulated
+    into neg, with 'values' also zeroing its parameters where it stays one.
+    counterexamples: number of diverse counterexamples bmc looks for per failing
+    property. samples: keep only the counterexamples that reject most of that
+    many hypotheses consistent with the observations (select_observations).
+    speculate: verify that many distinct hypotheses consistent with the
+    observations at once in the workers (all cores by default), accept the first
+    verified one, else add the counterexamples of all of them.
+    wp: put the weakest preconditions of the properties first among the
+    candidates and have the first synthesis prefer them.
+    """
+    def __init__(self, **options):
+        self.abstract_arrays = False
+        self.por = False
+        self.symmetry = False
+        self.portfolio = None
+        self.cubes = 0
+        self.depth = BOUND
+        self.adaptive = False
+        self.workers = None
+        self.deadline = None
+        self.synthesis_budget = None
+        self.verification_budget = None
+        self.max_iters = None
+        self.checkpoint = None
+        self.resume = True
+        self.warm_start = None
+        self.templates = None
+        self.minimize = False
+        self.counterexamples = 1
+        self.samples = 0
+        self.speculate = 0
+        self.wp = False
+        self.update(**options)
+
+    def update(self, **options):
+        for k, v in options.items():
+            if k not in vars(self):
+                raise TypeError("unknown cegis option: %s" % k)
+            setattr(self, k, v)
+        return self
 
 
 class smart_contract_state_machine:
-    def __init__(self, name):
+    def __init__(self, name, ctx=None):
         self.name = name
+        # z3 context of every expression and solver of this state machine, state
+        # machines in different contexts can be used from different threads
+        self.ctx = ctx if ctx != None else z3.main_ctx()
         self.states = {}
         self.prev_states = {}
         self.once = {}
@@ -19,14 +189,47 @@ class smart_contract_state_machine:
         self.candidate_condition_guards = {}
         self.tr_parameters = {}
         self.transfer_func = {}
+        # state read/written by each transfer function, excluding guards and frame conditions
+        self.tr_reads = {}
+        self.tr_writes = {}
         self.constants = []
-        self.ts = Ts(name)
+        # solver configuration for bmc (lib.portfolio.CONFIGS), defaults to the historical race winner
+        self.solver_config = None
+        # preprocessing profile for bmc (lib.preprocess.PROFILES), defaults to the one stored for the contract
+        self.tactic_profile = None
+        # preprocessing and solving times of bmc queries
+        self.solver_stats = None
+        # lib.bmc.BmcResult of the last bmc call, tells inconclusive checks apart from proved ones
+        self.last_bmc = None
+        # traces found by the last bmc call (several with count)
+        self.last_traces = []
+        # race depths that stay unknown after all timeouts across the solver portfolio
+        self.handoff = False
+        # indices of the candidate guards selected for each transition by the last synthesize
+        self.hypothesis = None
+        # solver time (ms) of one bmc call
+        self.bmc_budget = BUDGET
+        # (transitions, estimate) of the last reach_depth
+        self.reach = None
+        self.ts = Ts(name, self.ctx)
         self.now_state = None
-        self.now, self.nowOut = self.add_state('now', z3.BitVecSort(256))
-        self.func, self.funcOut = self.add_state('func', z3.StringSort())
+        self.now, self.nowOut = self.add_state('now', z3.BitVecSort(256, self.ctx))
+        self.func, self.funcOut = self.add_state('func', z3.StringSort(self.ctx))
 
         self.tracetable = {}
 
+    def translate(self, ctx):
+        '''A copy of the state machine whose expressions and solvers use the z3
+           context ctx, e.g. to synthesize it in another thread
+        '''
+        other = copy.copy(self)
+        for k, v in vars(self).items():
+            setattr(other, k, translate(v, ctx))
+        other.ctx = ctx
+        other.ts = self.ts.translate(ctx)
+        other.last_bmc = None
+        return other
+
     def add_state(self, state_name, type):
         state, stateOut = self.ts.add_var(type, name = state_name)
         prev_state, prev_stateOut = self.ts.add_var(type, name = "prev_" + state_name)
@@ -40,37 +243,156 @@ class smart_contract_state_machine:
 
     def add_tr(self, tr_name, parameters, guard, transfer_func):
         self.transitions.append(tr_name)
-        self.once[tr_name] = self.add_state("once_"+tr_name, z3.BoolSort())
+        self.once[tr_name] = self.add_state("once_"+tr_name, z3.BoolSort(self.ctx))
         self.tr_parameters[tr_name] = parameters
         self.condition_guards[tr_name] = guard
         self.candidate_condition_guards[tr_name] = []
-        transfer_func = z3.And(transfer_func, self.funcOut == tr_name, self.once[tr_name][1] == True)
+        transfer_func = expr(transfer_func, self.ctx)
+        self.tr_reads[tr_name] = self.read_set(transfer_func)
+        names = constant_names(transfer_func)
+        written = [state for state in self.states if self.states[state][1].__str__() in names]
+        self.tr_writes[tr_name] = ["once_"+tr_name] + written
+        conjunction = conjuncts(transfer_func) + [self.funcOut == tr_name, self.once[tr_name][1] == True]
         for state in self.states:
-            if state == 'now' or state == 'func':
-                continue
-            transfer_func = z3.simplify(z3.And(transfer_func, self.prev(self.states[state][0])[1] == self.states[state][0]))
-            if not contains(self.states[state][1], transfer_func):
-                transfer_func = z3.simplify(z3.And(transfer_func, self.states[state][1] == self.states[state][0]))
+            conjunction.append(self.prev(self.states[state][0])[1] == self.states[state][0])
+            if state not in written:
+                conjunction.append(self.states[state][1] == self.states[state][0])
+        transfer_func = z3.simplify(z3.And(conjunction))
         # print(transfer_func)
         self.transfer_func[tr_name] = transfer_func
 
+    def read_set(self, e):
+        names = constant_names(e)
+        reads = [state for state in self.states if self.states[state][0].__str__() in names]
+        reads += ["prev_"+state for state in self.prev_states if self.prev_states[state][0].__str__() in names]
+        reads += ["once_"+tr for tr in self.once if self.once[tr][0].__str__() in names]
+        if self.now.__str__() in names or self.nowOut.__str__() in names:
+            reads.append("now")
+        return reads
+
+    def independent(self, tr1, tr2):
+        '''Two transitions commute if neither writes what the other reads or writes.
+           Every transition implicitly writes now and the prev_ states, so reading
+           those makes a transition dependent on all others.
+        '''
+        if tr1 == tr2:
+            return False
+        reads1 = self.tr_reads[tr1] + self.read_set(self.condition_guards[tr1])
+        reads2 = self.tr_reads[tr2] + self.read_set(self.condition_guards[tr2])
+        if any(r == "now" or r[:5] == "prev_" for r in reads1 + reads2):
+            return False
+        writes1 = self.tr_writes[tr1]
+        writes2 = self.tr_writes[tr2]
+        return not any(w in reads2 or w in writes2 for w in writes1) and not any(w in reads1 for w in writes2)
+
+    def commuting_pairs(self):
+        '''Pairs (funcOut == b, funcOut == a) of adjacent steps excluded from the unrolling:
+           for independent a before b in self.transitions only the order a, b is explored
+        '''
+        pairs = []
+        for i in range(len(self.transitions)):
+            for j in range(i + 1, len(self.transitions)):
+                a, b = self.transitions[i], self.transitions[j]
+                if self.independent(a, b):
+                    pairs.append((self.funcOut == b, self.funcOut == a))
+        return pairs
+
+    def address_parameters(self, property):
+        '''Parameters interchangeable as account identities: bit-vector or integer
+           parameters only used as indices of arrays that are indexed by such
+           parameters (or quantified variables) alone, in the model and the property
+        '''
+        indexed = {}
+        plain = set()
+        for e in [self.ts.Init, property] + list(self.transfer_func.values()) + list(self.condition_guards.values()):
+            if not isinstance(e, bool):
+                index_uses(e, indexed, plain)
+        addresses = [v for v in self.parameters() if (z3.is_bv(v) or z3.is_int(v)) and v.__str__() not in plain]
+        while True:
+            names = [v.__str__() for v in addresses]
+            bad = [a for a in indexed if any(not z3.is_var(i) and i.__str__() not in names for i in indexed[a])]
+            used = [i.__str__() for a in indexed if a not in bad for i in indexed[a]]
+            kept = [v for v in addresses if v.__str__() in used and not any(v.__str__() == i.__str__() for a in bad for i in indexed[a])]
+            if len(kept) == len(addresses):
+                return addresses
+            addresses = kept
+
+    def symmetric_parameters(self, property):
+        '''Address parameters paired with the condition that their transition is taken'''
+        addresses = [v.__str__() for v in self.address_parameters(property)]
+        symmetric = []
+        for tr in self.transitions:
+            for v in self.tr_parameters[tr]:
+                if v.__str__() in addresses:
+                    symmetric.append((v, self.funcOut == tr))
+        return symmetric
+
+    def reach_depth(self):
+        '''Cheap estimate of the number of transitions needed to reach any state:
+           one more than the longest chain of distinct transitions each writing
+           state the next one reads, at most BOUND. A chain may pass through all
+           the transitions of a cycle, so it is the longest path over the strongly
+           connected components weighted by their size. Cached per transitions.
+        '''
+        if self.reach != None and self.reach[0] == tuple(self.transitions):
+            return self.reach[1]
+        feeds = {}
+        for a in self.transitions:
+            feeds[a] = [b for b in self.transitions if b != a and any(w in self.tr_reads[b] for w in self.tr_writes[a])]
+        # Tarjan: components are found sinks first
+        index = {}
+        low = {}
+        stack = []
+        component = {}
+        components = []
+        def visit(a):
+            index[a] = low[a] = len(index)
+            stack.append(a)
+            for b in feeds[a]:
+                if b not in index:
+                    visit(b)
+                    low[a] = min(low[a], low[b])
+                elif b in stack:
+                    low[a] = min(low[a], index[b])
+            if low[a] == index[a]:
+                members = []
+                while members == [] or members[-1] != a:
+                    members.append(stack.pop())
+                for b in members:
+                    component[b] = len(components)
+                components.append(members)
+        for a in self.transitions:
+            if a not in index:
+                visit(a)
+        longest = []
+        for members in components:
+            successors = set(component[b] for a in members for b in feeds[a]) - set([len(longest)])
+            longest.append(len(members) + max([longest[c] for c in successors] + [0]))
+        self.reach = (tuple(self.transitions), min(1 + max(longest + [0]), BOUND))
+        return self.reach[1]
+
+    def depth_schedule(self, bound, start=2):
+        '''Increasing BMC bounds for adaptive CEGIS: shallow first, then the reach
+           estimate, then the full bound
+        '''
+        return sorted(set([min(start, bound), min(self.reach_depth(), bound), bound]))
+
     def add_once(self):
         for tr in self.transitions:
-            for once in self.once:
-                if once != tr:
-                    # print(once, self.once[once][0])
-                    self.transfer_func[tr] = z3.And(self.transfer_func[tr], self.once[once][1] == self.once[once][0])
+            frames = [self.once[once][1] == self.once[once][0] for once in self.once if once != tr]
+            # print(frames)
+            self.transfer_func[tr] = z3.And(conjuncts(self.transfer_func[tr]) + frames)
 
     def clear_guards(self):
         for i in self.condition_guards.keys():
-            self.condition_guards[i] = z3.BoolVal(True)
+            self.condition_guards[i] = z3.BoolVal(True, self.ctx)
 
     def change_guard(self, tr_name, *new_guard):
         if tr_name not in self.transitions:
             print("Transition not found!")
             return False
         else:
-            self.condition_guards[tr_name] = z3.simplify(z3.And(*new_guard))
+            self.condition_guards[tr_name] = z3.simplify(z3.And(*new_guard, self.ctx))
             return True
         
     def add_guard(self, tr_name, *new_guard):
@@ -87,24 +409,24 @@ class smart_contract_state_machine:
             self.ts.Init = z3.simplify(z3.And(self.ts.Init, once[0] == False))
 
     def transfer(self, tr_name, candidates, next, *parameters):
-        success = z3.And(self.now_state, self.condition_guards[tr_name], self.nowOut > self.now, z3.And(*parameters))
+        success = z3.And(self.now_state, self.condition_guards[tr_name], self.nowOut > self.now, z3.And(*parameters, self.ctx))
         # print(success)
-        s = z3.Solver()
+        s = z3.Solver(ctx=self.ctx)
         s.add(success)
         result = s.check()
         if result == z3.unsat:
             return None
         else:
-            s = z3.Solver()
-            s.add(z3.And(self.now_state, self.transfer_func[tr_name], z3.And(*parameters)))
+            s = z3.Solver(ctx=self.ctx)
+            s.add(z3.And(self.now_state, self.transfer_func[tr_name], z3.And(*parameters, self.ctx)))
             # print(z3.And(self.now_state, self.transfer_func[tr_name], z3.And(*parameters)))
             result = s.check()
             m = s.model()
-            self.now_state = z3.BoolVal(True)
+            self.now_state = z3.BoolVal(True, self.ctx)
             for v in self.states.values():
                 self.now_state = z3.And(self.now_state, v[0] == m[v[1]])
             self.now_state = z3.simplify(self.now_state)
-            s = z3.Solver()
+            s = z3.Solver(ctx=self.ctx)
             # print(tr_name)
             s.add(self.now_state)
             s.add(next[1:])
@@ -128,7 +450,7 @@ class smart_contract_state_machine:
     def simulate(self, trace, candidates):
         res = []
         self.now_state = self.ts.Init
-        s = z3.Solver()
+        s = z3.Solver(ctx=self.ctx)
         # print(trace)
         s.add(self.now_state)
         s.add(trace[0][1:])
@@ -153,48 +475,228 @@ class smart_contract_state_machine:
             i += 1
         return res
         
-    def bmc(self, property):
+    def bmc(self, property, abstract_arrays=False, por=False, symmetry=False, portfolio=None, bound=BOUND, cubes=0, count=1, workers=None):
+        '''A trace reaching property, None if there is none up to bound. With count,
+           up to count diverse traces of that length are kept in last_traces.
+        '''
+        if abstract_arrays:
+            return self.bmc_abstract(property, por, symmetry, portfolio, bound, cubes, count, workers)
+        return self.bmc_model(property, self.ts.Init, self.transfer_func, por, symmetry, portfolio, bound, cubes, count, workers)
+
+    def cube_prefixes(self, length):
+        '''Every sequence of length transaction names, as constraints on the first steps'''
+        return [[self.funcOut == tr for tr in seq] for seq in itertools.product(self.transitions, repeat=length)]
+
+    def trace_blocks(self):
+        '''What tells counterexamples apart (see lib.bmc.bmc): the transaction
+           sequence, then the parameters of each transaction
+        '''
+        sequence = [(z3.BoolVal(True, self.ctx), [self.funcOut])]
+        keys = [(self.funcOut == tr, list(self.tr_parameters[tr])) for tr in self.transitions if self.tr_parameters[tr]]
+        return sequence, keys
+
+    def model_trace(self, model, depth, xs, xns, fvs):
+        states, params = BmcUnrolling(xs, xns, fvs).trace(model, depth)
+        trace = []
+        for i in range(1, depth + 1):
+            tr = states[i]['func'].as_string()
+            rule = [tr, self.nowOut == states[i]['now']]
+            # print(tr)
+            if self.tr_parameters[tr] != None:
+                for j in self.tr_parameters[tr]:
+                    rule.append(j == params[i][j.__str__()])
+            trace.append(tuple(rule))
+        return trace
+
+    def bmc_model(self, property, init, transfer_func, por=False, symmetry=False, portfolio=None, bound=BOUND, cubes=0, count=1,
+                  workers=None):
+        '''portfolio: list of solver configurations to race (True for all of them)
+           cubes: number of leading steps whose transaction is fixed per cube, the
+           cubes are solved in parallel (cube-and-conquer) in at most workers
+           processes (all cores by default)
+        '''
         import lib.bmc
-        lib.bmc.index = 0
-        self.ts.Tr = z3.BoolVal(False)
+        self.ts.Tr = z3.BoolVal(False, self.ctx)
         for tr in self.transitions:
-            self.ts.Tr = z3.simplify(z3.Or(self.ts.Tr, z3.And(self.transfer_func[tr], self.condition_guards[tr], self.nowOut > self.now)))
+            self.ts.Tr = z3.simplify(z3.Or(self.ts.Tr, z3.And(transfer_func[tr], self.condition_guards[tr], self.nowOut > self.now)))
+        xs, xns = self.unrolled_vars()
+        fvs = self.parameters()
+        # print(fvs)
+        # print(self.ts.Init)
+        # print(self.ts.Tr)
+        # print(property)
+        commute = self.commuting_pairs() if por else None
+        symmetric = self.symmetric_parameters(property) if symmetry else None
+        profile = self.tactic_profile or profile_for(self.name)
+        if cubes:
+            config = self.solver_config or historical_winner(self.name)
+            result = lib.bmc.cube_bmc(init, self.ts.Tr, property, fvs, xs, xns, self.cube_prefixes(cubes), commute=commute,
+                                      symmetric=symmetric, config=config, profile=profile, budget=self.bmc_budget,
+                                      bound=bound, workers=workers)
+        elif portfolio:
+            configs = None if portfolio == True else portfolio
+            result = lib.bmc.portfolio_bmc(init, self.ts.Tr, property, fvs, xs, xns, commute=commute, symmetric=symmetric,
+                                           configs=configs, benchmark=self.name, profile=profile, budget=self.bmc_budget, bound=bound)
+        else:
+            config = self.solver_config or historical_winner(self.name)
+            result = lib.bmc.bmc(init, self.ts.Tr, property, fvs, xs, xns, commute=commute, symmetric=symmetric, config=config,
+                                 profile=profile, stats=self.solver_stats, budget=self.bmc_budget, handoff=self.handoff, bound=bound,
+                                 count=count, block=self.trace_blocks())
+        self.last_bmc = result
+        self.last_traces = []
+        if result.model != None:
+            # print(result.model)
+            self.last_traces = [self.model_trace(m, result.depth, xs, xns, fvs) for m in result.models or [result.model]]
+            return self.last_traces[0]
+        else:
+            # print("No model found!")
+            return None
+
+    def unrolled_vars(self):
         xs = [v[0] for v in self.states.values()] + [v[0] for v in self.prev_states.values()] + [v[0] for v in self.once.values()] + [self.func] + [self.now]
         xns = [v[1] for v in self.states.values()] + [v[1] for v in self.prev_states.values()] + [v[1] for v in self.once.values()] + [self.funcOut] + [self.nowOut]
+        return xs, xns
+
+    def weakest_preconditions(self, properties):
+        '''Per transition, the conjuncts of the weakest preconditions of the
+           properties: each property over the post-state with the post-state
+           variables the transfer function defines (x' == e) replaced by their
+           definitions. Only the non-trivial ones over the vocabulary of
+           generate_candidate_guards (states, parameters, now' and constants) are
+           kept: simulate does not fix the once_ and prev_ states.
+        '''
+        xs, xns = self.unrolled_vars()
+        post = {v.__str__() for v in xns if not v.eq(self.nowOut)}
+        vocabulary = set(v[0].__str__() for v in self.states.values()) | {self.nowOut.__str__()}
+        vocabulary |= set(c.__str__() for c in self.constants if z3.is_expr(c))
+        wps = {}
+        for tr in self.transitions:
+            defs = []
+            for c in conjuncts(self.transfer_func[tr]):
+                if z3.is_not(c):
+                    c = c.arg(0) == False
+                elif z3.is_const(c) and c.__str__() in post:
+                    c = c == True
+                if not z3.is_eq(c):
+                    continue
+                for v, e in ((c.arg(0), c.arg(1)), (c.arg(1), c.arg(0))):
+                    if z3.is_const(v) and v.__str__() in post and not constant_names(e) & post:
+                        defs.append((v, e))
+                        break
+            wps[tr] = []
+            for property in properties:
+                wp = z3.simplify(z3.substitute(z3.substitute(property, zipp(xs, xns)), defs))
+                names = vocabulary | set(v.__str__() for v in self.tr_parameters[tr] or ())
+                for c in conjuncts(wp):
+                    if not (z3.is_true(c) or z3.is_false(c)) and constant_names(c) <= names:
+                        wps[tr].append(c)
+        return wps
+
+    def add_candidates(self, candidates, extra):
+        '''candidates with the predicates of extra (tr -> list) moved or added to
+           the front, and the hypothesis selecting exactly those
+        '''
+        hypothesis = {}
+        for tr in self.transitions:
+            front = []
+            for g in extra.get(tr, []):
+                if g.sexpr() not in [f.sexpr() for f in front]:
+                    front.append(g)
+            names = set(f.sexpr() for f in front)
+            candidates[tr] = front + [g for g in candidates[tr] if g.sexpr() not in names]
+            hypothesis[tr] = list(range(len(front)))
+            self.candidate_condition_guards[tr] = [z3.Const(tr+'_'+str(i), z3.BoolSort(self.ctx)) for i in range(len(candidates[tr]))]
+        return candidates, hypothesis
+
+    def parameters(self):
         fvs = []
         for p in self.tr_parameters.values():
             if p != None:
                 for v in p:
                     fvs.append(v)
-        # print(fvs)
-        # print(self.ts.Init)
-        # print(self.ts.Tr)
-        # print(property)
-        model = lib.bmc.bmc(self.ts.Init, self.ts.Tr, property, fvs, xs, xns)
-        if model != None:
-            # print(model)
-            rd = extract_model(model,'func')
-            # print(rd)
-            trace = []
-            for i in range(1, len(rd)-2):
-                # print(rd[i])
-                tr = rd[i]['func'].__str__()[1:-1]
-                rule = [tr, self.nowOut == rd[i]['now']]
-                # print(tr)
-                if self.tr_parameters[tr] != None:
-                    for j in self.tr_parameters[tr]:
-                        if j.__str__() in rd[i].keys():
-                            rule.append(j == rd[i][j.__str__()])
-                        else:
-                            # print("Error: parameter not found!", i, j.__str__())
-                            # print(j, type(rd[i-1][j.__str__()]))
-                            rule.append(j == rd[i-1][j.__str__()])
-                trace.append(tuple(rule))
+        return fvs
+
+    def check_trace(self, trace, goal, guarded=True):
+        '''Replay a trace on the concrete model (current guards included unless not
+           guarded), returns True if it is executable and ends in a state satisfying goal
+        '''
+        xs, xns = self.unrolled_vars()
+        fvs = self.parameters()
+        s = z3.Solver(ctx=self.ctx)
+        s.add(self.ts.Init)
+        cur = xs
+        for tr, *constraints in trace:
+            nxt = [z3.FreshConst(v.sort(), v.__str__()) for v in xns]
+            nfvs = [z3.FreshConst(v.sort(), v.__str__()) for v in fvs]
+            step = z3.And(self.transfer_func[tr], self.condition_guards[tr] if guarded else True, self.nowOut > self.now, *constraints)
+            s.add(z3.substitute(step, zipp(xs + xns + fvs, cur + nxt + nfvs)))
+            cur = nxt
+        # properties may refer to the post-state names (e.g. now'), which denote the checked state
+        s.add(z3.substitute(goal, zipp(xs + xns, cur + cur)))
+        return s.check() == z3.sat
+
+    def minimize_trace(self, trace, property, values=False):
+        '''A counterexample to property made of a 1-minimal subsequence of the steps
+           of trace (delta debugging, each candidate replayed with the current guards).
+           With values, each integer or bit-vector parameter is then set to 0 where
+           the replay still violates property.
+        '''
+        bad = z3.Not(property)
+        trace = ddmin(trace, lambda steps: steps != [] and self.check_trace(steps, bad))
+        if not values:
             return trace
-        else:
-            # print("No model found!")
-            return None
-        
+        fvs = [v.__str__() for v in self.parameters()]
+        for i in range(len(trace)):
+            for j in range(2, len(trace[i])):
+                c = trace[i][j]
+                if not (z3.is_eq(c) and c.arg(0).__str__() in fvs) or not (z3.is_bv(c.arg(0)) or z3.is_int(c.arg(0))):
+                    continue
+                zero = z3.BitVecVal(0, c.arg(0).size(), self.ctx) if z3.is_bv(c.arg(0)) else z3.IntVal(0, self.ctx)
+                if c.arg(1).eq(zero):
+                    continue
+                step = trace[i][:j] + (c.arg(0) == zero,) + trace[i][j + 1:]
+                if self.check_trace(trace[:i] + [step] + trace[i + 1:], bad):
+                    trace = trace[:i] + [step] + trace[i + 1:]
+        return trace
+
+    def havoc_arrays(self, havoc):
+        '''Returns the initial condition and transfer functions with the constraints
+           on the given array states dropped, i.e. those arrays are havocked
+        '''
+        ins = [self.states[s][0] for s in havoc] + [self.prev_states[s][0] for s in havoc]
+        outs = [self.states[s][1] for s in havoc] + [self.prev_states[s][1] for s in havoc]
+        init = z3.And([c for c in conjuncts(self.ts.Init) if not any(contains(v, c) for v in ins)], self.ctx)
+        transfer_func = {}
+        for tr in self.transitions:
+            transfer_func[tr] = z3.And([c for c in conjuncts(self.transfer_func[tr]) if not any(contains(v, c) for v in outs)], self.ctx)
+        return init, transfer_func
+
+    def bmc_abstract(self, property, por=False, symmetry=False, portfolio=None, bound=BOUND, cubes=0, count=1, workers=None):
+        '''BMC with array abstraction refinement: array states the property does not
+           mention start havocked, spurious counterexamples add back the arrays read
+           along the trace until the counterexample replays on the concrete model
+        '''
+        havoc = []
+        for s in self.states:
+            if z3.is_array(self.states[s][0]) and not any(contains(v, property) for v in self.states[s] + self.prev_states[s]):
+                havoc.append(s)
+        while True:
+            init, transfer_func = self.havoc_arrays(havoc)
+            trace = self.bmc_model(property, init, transfer_func, por, symmetry, portfolio, bound, cubes, count, workers)
+            if trace == None or havoc == [] or self.check_trace(trace, property):
+                # the other traces may be spurious
+                self.last_traces = [t for t in self.last_traces if t is trace or havoc == [] or self.check_trace(t, property)]
+                return trace
+            # spurious: refine with the arrays the trace's transitions read
+            refined = []
+            for s in havoc:
+                for tr, *_ in trace:
+                    if contains(self.states[s][0], self.transfer_func[tr]) or contains(self.states[s][0], self.condition_guards[tr]):
+                        refined.append(s)
+                        break
+            if refined == []:
+                refined = havoc
+            havoc = [s for s in havoc if s not in refined]
 
     def generate_candidate_guards(self, predicates, array):
         candidate_guards = {}
@@ -257,7 +759,7 @@ class smart_contract_state_machine:
         for tr in self.candidate_condition_guards:
             self.candidate_condition_guards[tr] = []
             for i in range(len(candidate_guards[tr])):
-                self.candidate_condition_guards[tr].append(z3.Const(tr+'_'+str(i), z3.BoolSort()))
+                self.candidate_condition_guards[tr].append(z3.Const(tr+'_'+str(i), z3.BoolSort(self.ctx)))
         # for tr in self.transitions:
         #     if len(candidate_guards[tr]) > maxlen:
         #         maxlen = len(candidate_guards[tr])
@@ -360,61 +862,293 @@ class smart_contract_state_machine:
     #         print("----------------------------------------------")
 
 
-    def synthesize(self, pos, neg, candidates):
-        s = z3.Solver()
-        approvePos = z3.BoolVal(True)
+    def approves(self, trace):
+        '''Whether the guards accept every step of an observed trace (rows of a
+           transition name and the values of its candidate guards)
+        '''
+        approveT = z3.BoolVal(True, self.ctx)
+        for tr_res in trace:
+            tr = tr_res[0]
+            approvetx = z3.BoolVal(True, self.ctx)
+            for i in range(1, len(tr_res)):
+                approvetx = z3.And(approvetx, z3.Implies(self.candidate_condition_guards[tr][i-1], tr_res[i]))
+            approveT = z3.And(approveT, approvetx)
+        return approveT
+
+    def observations(self, pos, neg):
+        '''The guards accept the positive and reject the negative observations'''
+        approvePos = z3.BoolVal(True, self.ctx)
         for postrace in pos:
-            approveT = z3.BoolVal(True)
-            for tr_res in postrace:
-                tr = tr_res[0]
-                approvetx = z3.BoolVal(True)
-                for i in range(1, len(tr_res)):
-                    approvetx = z3.And(approvetx, z3.Implies(self.candidate_condition_guards[tr][i-1], tr_res[i]))
-                approveT = z3.And(approveT, approvetx)
-            approvePos = z3.And(approvePos, approveT)
-        approveNeg = z3.BoolVal(True)
+            approvePos = z3.And(approvePos, self.approves(postrace))
+        approveNeg = z3.BoolVal(True, self.ctx)
         for negtrace in neg:
-            approveT = z3.BoolVal(True)
-            for tr_res in negtrace:
-                tr = tr_res[0]
-                approvetx = z3.BoolVal(True)
-                for i in range(1, len(tr_res)):
-                    approvetx = z3.And(approvetx, z3.Implies(self.candidate_condition_guards[tr][i-1], tr_res[i]))
-                approveT = z3.And(approveT, approvetx)
-            approveNeg = z3.And(approveNeg, z3.Not(approveT))
+            approveNeg = z3.And(approveNeg, z3.Not(self.approves(negtrace)))
+        return approvePos, approveNeg
+
+    def synthesize(self, pos, neg, candidates, timeout=None, prefer=None):
+        '''Selects candidate guards accepting the positive and rejecting the negative
+           observations. timeout (ms) bounds the solver; returns its result.
+           prefer: a hypothesis kept, as far as consistent, for the transitions it covers
+        '''
+        s = z3.Solver(ctx=self.ctx)
+        if timeout != None:
+            s.set("timeout", max(int(timeout), 1))
+        approvePos, approveNeg = self.observations(pos, neg)
         # print(approveNeg)
         s.add(approvePos)
         s.add(approveNeg)
-        result = s.check()
+        result = z3.unknown
+        if prefer != None:
+            result = check_preferring(s, [c if i in prefer[tr] else z3.Not(c) for tr in prefer
+                                          for i, c in enumerate(self.candidate_condition_guards[tr])])
+        if result != z3.sat:
+            result = s.check()
         if result == z3.sat:
-            self.clear_guards()
             m = s.model()
             # print(m)
+            self.hypothesis = {}
             for tr in self.transitions:
-                for c in range(len(candidates[tr])):
-                    if m[self.candidate_condition_guards[tr][c]]:
-                        self.add_guard(tr, candidates[tr][c])
+                self.hypothesis[tr] = [c for c in range(len(candidates[tr])) if m[self.candidate_condition_guards[tr][c]]]
+            self.apply_hypothesis(candidates, self.hypothesis)
             # print(self.condition_guards)
-        else:
+        elif result == z3.unsat:
             print("No solution found!")
-    def cegis(self, properties, positive_traces, candidate_guard, array = True):
+            self.hypothesis = {tr: [] for tr in self.transitions}
+            self.apply_hypothesis(candidates, self.hypothesis)
+        return result
+
+    def sample_hypotheses(self, pos, neg, n, timeout=None, seed=0, spread=True, exclude=[]):
+        '''Up to n distinct hypotheses consistent with the observations other than
+           those of exclude; with spread each as close as they allow to a random
+           selection of the candidates, else in the order the solver finds them
+        '''
+        s = z3.Solver(ctx=self.ctx)
+        if timeout != None:
+            s.set("timeout", max(int(timeout), 1))
+        s.add(self.observations(pos, neg))
+        guards = [(tr, i, c) for tr in self.transitions for i, c in enumerate(self.candidate_condition_guards[tr])]
+        def block(selected):
+            return z3.Or([c != z3.BoolVal(b, self.ctx) for (tr, i, c), b in zip(guards, selected)] + [z3.BoolVal(False, self.ctx)])
+        for h in exclude:
+            s.add(block([i in h[tr] for tr, i, c in guards]))
+        # the candidates every positive observation satisfies, any selection of them accepts pos
+        allowed = [c for tr, i, c in guards
+                   if all(z3.is_true(tr_res[i + 1]) for postrace in pos for tr_res in postrace if tr_res[0] == tr)]
+        rnd = random.Random(seed)
+        samples = []
+        while len(samples) < n and check_preferring(s, [c for c in allowed if spread and rnd.random() < 0.5]) == z3.sat:
+            m = s.model()
+            selected = [z3.is_true(m.eval(c, model_completion=True)) for tr, i, c in guards]
+            samples.append({tr: [i for (t, i, c), b in zip(guards, selected) if t == tr and b] for tr in self.transitions})
+            s.add(block(selected))
+        return samples
+
+    def accepts(self, hypothesis, trace):
+        '''Whether hypothesis accepts every step of an observed trace (see ground)'''
+        return all(z3.is_true(tr_res[c + 1]) for tr_res in trace for c in hypothesis[tr_res[0]])
+
+    def ground(self, trace):
+        '''Whether every candidate guard of an observed trace has a value: simulate
+           leaves those over states it does not fix (once_, prev_) symbolic
+        '''
+        return all(z3.is_true(v) or z3.is_false(v) for tr_res in trace for v in tr_res[1:])
+
+    def select_observations(self, traces, samples, groups):
+        '''Indices of the observed negative traces to keep, in order of information
+           gain: greedily the trace rejecting most of the sampled hypotheses not yet
+           rejected, first one per group (e.g. per failing property), then any
+           trace that still rejects one. The gain of traces that are not ground is
+           unknown, they are all kept.
+        '''
+        alive = samples
+        chosen = [i for i in range(len(traces)) if not self.ground(traces[i])]
+        while True:
+            covered = set(groups[i] for i in chosen)
+            options = [i for i in range(len(traces)) if i not in chosen and groups[i] not in covered] or \
+                      [i for i in range(len(traces)) if i not in chosen]
+            if options == []:
+                break
+            gain, i = max((len([h for h in alive if self.accepts(h, traces[i])]), -i) for i in options)
+            i = -i
+            if gain == 0 and len(covered) == len(set(groups)):
+                break
+            chosen.append(i)
+            alive = [h for h in alive if not self.accepts(h, traces[i])]
+        return chosen
+
+    def apply_hypothesis(self, candidates, hypothesis):
+        '''Sets the guard of each transition to the conjunction of the candidates
+           whose indices hypothesis selects
+        '''
+        self.clear_guards()
+        for tr in self.transitions:
+            for c in hypothesis[tr]:
+                self.add_guard(tr, candidates[tr][c])
+    def fingerprint(self, properties):
+        '''Digest of the initial state, transitions and properties, telling whether a
+           checkpoint is of the same specification
+        '''
+        h = hashlib.sha1(self.ts.Init.sexpr().encode())
+        for tr in self.transitions:
+            h.update(("%s %s %s" % (tr, self.tr_parameters[tr], self.transfer_func[tr].sexpr())).encode())
+        for p in properties:
+            h.update(p.sexpr().encode())
+        return h.hexdigest()
+
+    def revalidate(self, ntraces, properties):
+        '''The negative traces still executable (guards aside) in this model and
+           ending in a state that violates one of the properties
+        '''
+        bad = z3.Or([z3.Not(p) for p in properties] + [z3.BoolVal(False, self.ctx)])
+        return [trace for trace in ntraces
+                if all(step[0] in self.transitions for step in trace) and self.check_trace(trace, bad, guarded=False)]
+
+    def carry_hypothesis(self, state, candidates):
+        '''The final hypothesis of a checkpointed run as indices into candidates, for
+           the transitions and candidate guards both runs have
+        '''
+        old = state['hypothesis'] if state['best'] == None else state['best'][1]
+        if old == None:
+            return None
+        hypothesis = {}
+        for tr in self.transitions:
+            if tr in old and tr in state['candidate_guard']:
+                index = {g.sexpr(): i for i, g in enumerate(candidates[tr])}
+                selected = [state['candidate_guard'][tr][c].sexpr() for c in old[tr]]
+                hypothesis[tr] = [index[g] for g in selected if g in index]
+        return hypothesis
+
+    def preference(self, candidate_guard, warm=None, templates=None, preconditions=None, printing=True):
+        '''The hypothesis the first synthesis of a new run prefers: the final one of
+           the run warm started from, else the one the guard templates propose,
+           together with the weakest preconditions (see add_candidates). Returns it
+           (None if there is none) and whether the templates proposed it.
+        '''
+        prefer = None
+        templated = False
+        if warm != None:
+            prefer = self.carry_hypothesis(warm, candidate_guard)
+        elif templates != None:
+            prefer = lib.templates.propose(self, candidate_guard, templates) or None
+            templated = prefer != None
+            if printing and templated:
+                print("guard templates for %d of %d transitions" % (len(prefer), len(self.transitions)))
+        if preconditions != None and any(preconditions.values()):
+            # on top of the guards carried over or proposed
+            prefer = {tr: sorted(set((prefer or {}).get(tr, [])) | set(preconditions[tr]))
+                      for tr in self.transitions if tr in (prefer or {}) or preconditions[tr]}
+            if printing:
+                print("weakest preconditions:", {tr: [candidate_guard[tr][i] for i in preconditions[tr]] for tr in preconditions if preconditions[tr]})
+        return prefer, templated
+
+    def verify_hypotheses(self, properties, hypotheses, pool, bound, budget, options):
+        '''Per hypothesis, a pair (status, counterexamples) per property from bmc up
+           to bound: all the hypotheses in the pool (see cegis), else the current
+           one only. budget() gives the ms left, None if unbounded; a property left
+           unchecked or whose job failed is inconclusive.
+        '''
+        o = options
+        if pool != None:
+            left = budget()
+            jobs = [(i, h, bound, self.bmc_budget if left == None else min(left, self.bmc_budget))
+                    for h in hypotheses for i in range(len(properties))]
+            outcomes = pool.map(jobs) if left == None or left > 0 else [None] * len(jobs)
+            outcomes = [('inconclusive', []) if r == None else (r[0], [decode_trace(t, self.ctx) for t in r[1]]) for r in outcomes]
+            return [outcomes[k * len(properties):(k + 1) * len(properties)] for k in range(len(hypotheses))]
+        outcomes = []
+        bmc_budget = self.bmc_budget
+        for p in properties:
+            left = budget()
+            if left != None and left <= 0:
+                # out of time, not checked
+                outcomes.append(('inconclusive', []))
+                continue
+            self.bmc_budget = bmc_budget if left == None else min(left, bmc_budget)
+            self.bmc(z3.Not(p), o.abstract_arrays, o.por, o.symmetry, o.portfolio, bound, o.cubes, o.counterexamples, o.workers)
+            self.bmc_budget = bmc_budget
+            outcomes.append((self.last_bmc.status, self.last_traces))
+        return [outcomes]
+
+    def add_counterexamples(self, ntraces, sources, i, traces, property, minimize=False):
+        '''Adds the counterexamples traces to property i to ntraces, each once, and i
+           to sources for each; minimized first with minimize (True, or 'values',
+           see minimize_trace). Returns the number of steps minimization removed.
+        '''
+        steps = 0
+        for ntrace in traces:
+            if minimize:
+                length = len(ntrace)
+                ntrace = self.minimize_trace(ntrace, property, minimize == 'values')
+                steps += length - len(ntrace)
+            # minimized counterexamples may coincide
+            if ntrace.__str__() not in [t.__str__() for t in ntraces]:
+                ntraces.append(ntrace)
+                sources.append(i)
+        return steps
+
+    def observe_counterexamples(self, ntraces, sources, candidate_guard, pos, neg, samples=0, timeout=None):
+        '''Pairs (observation row, trace) of the negative traces to add to neg: all
+           of them, or with samples those select_observations keeps against the
+           current hypothesis and that many others consistent with pos and neg
+           (sampled within timeout ms). sources groups the traces.
+        '''
+        self.clear_guards()
+        rows = [self.simulate(ntrace, candidate_guard) for ntrace in ntraces]
+        chosen = range(len(ntraces))
+        if samples and len(ntraces) > 1:
+            hypotheses = [self.hypothesis] + self.sample_hypotheses(pos, neg, samples, timeout)
+            chosen = self.select_observations(rows, hypotheses, sources)
+        return [(rows[i], ntraces[i]) for i in chosen]
+
+    def cegis(self, properties, positive_traces, candidate_guard, array = True, options = None, **kwargs):
+        '''Synthesizes guards among candidate_guard (tr -> list of predicates, by
+           default generated over the states, parameters and constants, and with
+           array the array elements) under which the properties hold up to the
+           bound. options: a CegisOptions, updated by the keyword arguments, e.g.
+           cegis(properties, positive_traces, None, deadline=600).
+           Returns a CegisResult.
+        '''
+        if getattr(loading, 'calls', None) != None:
+            loading.calls.append((self, properties, positive_traces, candidate_guard))
+            return None
+        o = CegisOptions() if options == None else copy.copy(options)
+        o.update(**kwargs)
         printing = True
         # printing = False
         synthesis_time = 0
         verification_time = 0
+        deadline = o.deadline
+        if deadline == None and os.environ.get("CEGIS_DEADLINE"):
+            deadline = float(os.environ["CEGIS_DEADLINE"])
+        checkpoint = lib.checkpoint.path_for(self.name, o.checkpoint)
+        templates = lib.templates.path_for(o.templates)
+        state, warm = lib.checkpoint.restore(checkpoint, self, properties, o.resume, o.warm_start)
+        if state != None:
+            candidate_guard = state['candidate_guard']
         if candidate_guard == None:
             candidate_guard = self.generate_candidate_guards(["<", "<=", ">", ">=", "="], array)
         else:
+            self.clear_guards()
             for tr in self.candidate_condition_guards:
                 self.candidate_condition_guards[tr] = []
-                for i in range(len(candidate_guard)):
-                    self.candidate_condition_guards[tr].append(z3.Const(tr+'_'+str(i), z3.BoolSort()))
+                for i in range(len(candidate_guard[tr])):
+                    self.candidate_condition_guards[tr].append(z3.Const(tr+'_'+str(i), z3.BoolSort(self.ctx)))
+        preconditions = None
+        if o.wp and state == None:
+            candidate_guard, preconditions = self.add_candidates(candidate_guard, self.weakest_preconditions(properties))
         # return 
         pos = []
         neg = []
+        ntraces = []
         T0 = time.time()
+        def remaining(budget=None, since=None):
+            '''seconds left of budget counted from since and of the deadline, None if unbounded'''
+            left = [] if deadline == None else [deadline - (time.time() - T0)]
+            if budget != None:
+                left.append(budget - (time.time() - since))
+            return min(left) if left else None
         T1 = time.time()
-        for ptrace in positive_traces:
+        for ptrace in (positive_traces if state == None else []):
             res = self.simulate(ptrace, candidate_guard)
             print("trace:")
             print(ptrace)
@@ -423,58 +1157,231 @@ class smart_contract_state_machine:
             print("res:")
             print(res)
             pos.append(res)
+        # counterexamples of the previous specification
+        if warm != None:
+            ntraces = self.revalidate(warm['ntraces'], properties)
+            neg = [self.simulate(ntrace, candidate_guard) for ntrace in ntraces]
+            if printing:
+                print("warm start: %d of %d negative traces still valid" % (len(ntraces), len(warm['ntraces'])))
+        prefer, templated = None, False
+        if state == None:
+            prefer, templated = self.preference(candidate_guard, warm, templates, preconditions, printing)
         T2 = time.time()
         synthesis_time += T2 - T1
         # print(pos)
         # for posi in pos:
         #     print(posi[0], len(posi))
+        # adaptive: verify shallow first, deepen once a hypothesis survives the current bound
+        bounds = self.depth_schedule(o.depth) if o.adaptive else [o.depth]
+        level = 0
+        resynthesize = True
         iter = 0
-        while True:
-            iter += 1
-            if printing:
-                print("iter", iter, end="| ")
-            # print("pos:", pos)
-            # print("neg:", neg)
-            ##sample one concrete contract
-            T1 = time.time()
-            self.synthesize(pos, neg, candidate_guard)
-            T2 = time.time()
-            synthesis_time += T2 - T1            
-            if printing:
-                print(self.condition_guards)
-            ##verify the properties
-            T1 = time.time()
-            new_ntraces = []
-            for p in properties:
-                ntrace = self.bmc(z3.Not(p))
-                if ntrace == None:
+        status = None
+        # (score, hypothesis, verified, failing, inconclusive) of the best hypothesis verified so far,
+        # properties by index
+        best = None
+        # time of the runs resumed from
+        elapsed = 0
+        if state != None:
+            pos, neg, ntraces = state['pos'], state['neg'], state['ntraces']
+            level, resynthesize, iter = min(state['level'], len(bounds) - 1), state['resynthesize'], state['iterations']
+            synthesis_time, verification_time, elapsed = state['synthesis_time'], state['verification_time'], state['time']
+            self.hypothesis = state['hypothesis']
+            if self.hypothesis != None:
+                self.apply_hypothesis(candidate_guard, self.hypothesis)
+            if state['best'] != None:
+                best = (tuple(state['best'][0]),) + tuple(state['best'][1:])
+            if state.get('status') in FINAL:
+                # the run finished: its result, without running again
+                status = state['status']
+                if printing:
+                    print("%s already %s in %s" % (self.name, status, checkpoint))
+            elif printing:
+                print("resuming from %s: iteration %d, %d negative traces" % (checkpoint, iter, len(neg)))
+        finished = status != None
+        start = iter
+        saved = time.time()
+        def save(status=None):
+            lib.checkpoint.save(checkpoint, self, {'pos': pos, 'neg': neg, 'ntraces': ntraces, 'candidate_guard': candidate_guard,
+                                                   'properties': properties, 'model': self.fingerprint(properties),
+                                                   'hypothesis': self.hypothesis, 'best': best,
+                                                   'level': level, 'resynthesize': resynthesize, 'iterations': iter,
+                                                   'synthesis_time': synthesis_time, 'verification_time': verification_time,
+                                                   'time': elapsed + time.time() - T0, 'status': status})
+        pool = None
+        workers = o.workers
+        if o.speculate > 1:
+            workers = workers or os.cpu_count()
+        if workers and not finished:
+            def verify(job):
+                i, hypothesis, bound, budget = job
+                self.apply_hypothesis(candidate_guard, hypothesis)
+                self.bmc_budget = budget
+                # the cubes of the jobs running at once share the cores
+                self.bmc(z3.Not(properties[i]), o.abstract_arrays, o.por, o.symmetry, o.portfolio, bound, o.cubes, o.counterexamples,
+                         max(os.cpu_count() // workers, 1))
+                return self.last_bmc.status, [encode_trace(t) for t in self.last_traces]
+            pool = ForkServer(verify, workers)
+        try:
+            while status == None:
+                if checkpoint != None and time.time() - saved >= lib.checkpoint.INTERVAL:
+                    save()
+                    saved = time.time()
+                if o.max_iters != None and iter - start >= o.max_iters:
+                    status = 'max_iters'
+                    break
+                left = remaining()
+                if left != None and left <= 0:
+                    status = 'deadline'
+                    break
+                iter += 1
+                if printing:
+                    print("iter", iter, end="| ")
+                # print("pos:", pos)
+                # print("neg:", neg)
+                ##sample one concrete contract
+                if resynthesize:
+                    T1 = time.time()
+                    left = remaining(o.synthesis_budget, T1)
+                    result = self.synthesize(pos, neg, candidate_guard, None if left == None else max(left, 0) * 1000, prefer)
+                    prefer = None
+                    T2 = time.time()
+                    synthesis_time += T2 - T1            
+                    if result == z3.unsat:
+                        status = 'unrealizable'
+                        break
+                    if result == z3.unknown:
+                        if printing:
+                            print("synthesis timed out")
+                        status = 'deadline' if remaining() != None and remaining() <= 0 else 'synthesis timeout'
+                        break
+                if printing:
+                    print(self.condition_guards)
+                ##verify the properties
+                T1 = time.time()
+                def budget():
+                    '''ms left for the next property, None if unbounded'''
+                    left = remaining(o.verification_budget, T1)
+                    return None if left == None else left * 1000
+                hypotheses = [self.hypothesis]
+                if pool != None and o.speculate > 1 and resynthesize:
+                    left = budget()
+                    hypotheses += self.sample_hypotheses(pos, neg, o.speculate - 1, None if left == None else max(left, 0), spread=False,
+                                                         exclude=hypotheses)
+                grouped = self.verify_hypotheses(properties, hypotheses, pool, bounds[level], budget, o)
+                # the first hypothesis verified, else the synthesized one
+                lead = next((k for k in range(len(hypotheses)) if all(s != 'inconclusive' and t == [] for s, t in grouped[k])), 0)
+                if lead != 0:
+                    self.hypothesis = hypotheses[lead]
+                    self.apply_hypothesis(candidate_guard, self.hypothesis)
                     if printing:
-                        print("√", end="")
-                else:
-                    new_ntraces.append(ntrace)
+                        print("speculative hypothesis %d of %d verified" % (lead + 1, len(hypotheses)), self.condition_guards)
+                new_ntraces = []
+                # the property of each counterexample
+                sources = []
+                verified = []
+                failing = []
+                inconclusive = []
+                # steps removed from the counterexamples by minimize_trace
+                removed = 0
+                for i, (outcome, traces) in enumerate(grouped[lead]):
+                    if traces == [] and outcome == 'inconclusive':
+                        inconclusive.append(i)
+                        if printing:
+                            print("?", end="")
+                    elif traces == []:
+                        verified.append(i)
+                        if printing:
+                            print("√", end="")
+                    else:
+                        failing.append(i)
+                        removed += self.add_counterexamples(new_ntraces, sources, i, traces, properties[i], o.minimize)
+                        if printing:
+                            print("×", end="")
+                if printing:
+                    print()
+                if new_ntraces != [] and len(hypotheses) > 1:
+                    # the counterexamples of the other speculative hypotheses, minimized under their guards
+                    for k in range(len(hypotheses)):
+                        if k != lead:
+                            self.apply_hypothesis(candidate_guard, hypotheses[k])
+                            for i, (outcome, traces) in enumerate(grouped[k]):
+                                removed += self.add_counterexamples(new_ntraces, sources, i, traces, properties[i], o.minimize)
+                    self.apply_hypothesis(candidate_guard, self.hypothesis)
+                if printing and removed:
+                    print("minimized the counterexamples by %d steps" % removed)
+                score = (level, -len(failing), len(verified))
+                if best == None or score > best[0]:
+                    best = (score, self.hypothesis, verified, failing, inconclusive)
+                if new_ntraces == [] and level < len(bounds) - 1:
+                    verification_time += time.time() - T1
+                    level += 1
+                    resynthesize = False
+                    if printing:
+                        print("no counterexample up to depth %d, deepening to %d" % (bounds[level-1], bounds[level]))
+                    continue
+                resynthesize = True
+                T2 = time.time()
+                verification_time += T2 - T1
+                if new_ntraces == []:
+                    if printing and inconclusive == []:
+                        print("all properties verified!")
+                    elif printing:
+                        print("no counterexample found, %d properties inconclusive" % len(inconclusive))
+                    status = 'verified' if inconclusive == [] else 'inconclusive'
+                    if inconclusive != [] and remaining() != None and remaining() <= 0:
+                        # the deadline ran out during the verification
+                        status = 'deadline'
+                    break
+                T1 = time.time()
+                left = remaining(o.synthesis_budget, T1)
+                observed = self.observe_counterexamples(new_ntraces, sources, candidate_guard, pos, neg, o.samples,
+                                                        None if left == None else max(left, 0) * 1000)
+                if printing and o.samples and len(new_ntraces) > 1:
+                    print("kept %d of %d counterexamples" % (len(observed), len(new_ntraces)))
+                for row, ntrace in observed:
                     if printing:
-                        print("×", end="")
+                        print(ntrace)
+                    neg.append(row)
+                    ntraces.append(ntrace)
+                T2 = time.time()
+                synthesis_time += T2 - T1
+        finally:
+            if pool != None:
+                pool.close()
+            if checkpoint != None and not finished:
+                save(status)
+        T3 = T0 if finished else time.time()
+        if status not in ('verified', 'inconclusive'):
             if printing:
-                print()
-            if new_ntraces == []:
-                if printing:
-                    print("all properties verified!")
-                break
-            T2 = time.time()
-            verification_time += T2 - T1
+                print("stopped:", status)
+        result = CegisResult(status, iter, synthesis_time, verification_time, elapsed + T3 - T0)
+        if best != None:
+            _, result.hypothesis, verified, failing, inconclusive = best
+            result.verified = [properties[i] for i in verified]
+            result.failing = [properties[i] for i in failing]
+            result.inconclusive = [properties[i] for i in inconclusive]
+            self.hypothesis = result.hypothesis
+            self.apply_hypothesis(candidate_guard, self.hypothesis)
+        else:
+            # nothing verified yet
+            result.inconclusive = list(properties)
             self.clear_guards()
-            T1 = time.time()
-            for negtrace in new_ntraces:
+        result.guards = dict(self.condition_guards)
+        if templates != None and status == 'verified' and not finished:
+            cold = lib.templates.cold_iterations(self.name, templates)
+            if templated and cold != None:
+                result.iterations_saved = cold - iter
                 if printing:
-                    print(negtrace)
-                neg.append(self.simulate(negtrace, candidate_guard))
-            T2 = time.time()
-            synthesis_time += T2 - T1
-        T3 = time.time()
-        print(self.name, "| Time cost:%ss" % (T3 - T0), end="| ")
+                    print("guard templates: %d iterations, %d saved" % (iter, result.iterations_saved))
+            elif templated and printing:
+                print("guard templates: %d iterations, no run without templates to compare" % iter)
+            lib.templates.record(self, candidate_guard, result.hypothesis, iter, not templated and state == None and warm == None,
+                                 templates)
+        print(self.name, "| Time cost:%ss" % (elapsed + T3 - T0), end="| ")
         print("Synthesis time:%ss" % synthesis_time, end="| ")
         print("Verification time:%ss" % verification_time, end="| ")
         print("iterations:", iter)
         if printing:
             print(self.condition_guards)
-        return
\ No newline at end of file
+        return result
\ No newline at end of file
@@ -0,0 +1,96 @@
+'''Library of the guards synthesized for earlier contracts, keyed by the shape of
+a transition (sorts of its parameters, of the state it writes and of the state
+it reads), so that variants of a contract (erc20, shib, bnb, ...) start from the
+guards of the others. Guards are stored with their constants renamed to roles:
+param<i> for the parameters, w<k>, r<k> and o<k> for the states the transition
+writes, only reads or ignores (numbered per sort, in name order).
+'''
+import os
+import json
+import z3
+
+TEMPLATES = 'guard_templates.json'
+
+def path_for(path=None):
+    '''path, or the library named by CEGIS_TEMPLATES, or None'''
+    if path == None and os.environ.get("CEGIS_TEMPLATES"):
+        path = os.environ["CEGIS_TEMPLATES"]
+    return path
+
+def load_templates(path=TEMPLATES):
+    if not os.path.exists(path):
+        return {'shapes': {}, 'iterations': {}}
+    with open(path) as f:
+        return json.load(f)
+
+def shape(statemachine, tr):
+    sm = statemachine
+    params = [p.sort().sexpr() for p in sm.tr_parameters[tr] or ()]
+    writes = sorted(sm.states[n][0].sort().sexpr() for n in sm.tr_writes[tr] if n in sm.states)
+    reads = sorted(sm.states[n][0].sort().sexpr() for n in sm.tr_reads[tr] if n in sm.states and n not in sm.tr_writes[tr])
+    return json.dumps([params, writes, reads])
+
+def roles(statemachine, tr):
+    '''Pairs (constant, role) for the constants of the guards of tr'''
+    sm = statemachine
+    pairs = [(p, z3.Const("param%d" % i, p.sort())) for i, p in enumerate(sm.tr_parameters[tr] or ())]
+    counts = {}
+    for name in sorted(sm.states):
+        kind = 'w' if name in sm.tr_writes[tr] else 'r' if name in sm.tr_reads[tr] else 'o'
+        v, vOut = sm.states[name]
+        k = counts[kind, v.sort().sexpr()] = counts.get((kind, v.sort().sexpr()), -1) + 1
+        role = "%s%d" % (kind, k)
+        pairs += [(v, z3.Const(role, v.sort())), (vOut, z3.Const(role + "'", v.sort())),
+                  (sm.prev_states[name][0], z3.Const("prev_" + role, v.sort()))]
+    pairs.append((sm.once[tr][0], z3.Const("once", z3.BoolSort(sm.ctx))))
+    return pairs
+
+def abstract(guard, pairs):
+    return z3.substitute(guard, pairs).sexpr()
+
+def record(statemachine, candidates, hypothesis, iterations, cold, path=TEMPLATES):
+    '''Adds the guards hypothesis selects, and with cold the number of iterations
+       the contract took without templates
+    '''
+    sm = statemachine
+    library = load_templates(path)
+    for tr in sm.transitions:
+        pairs = roles(sm, tr)
+        guards = sorted(abstract(candidates[tr][c], pairs) for c in hypothesis[tr])
+        entries = library['shapes'].setdefault(shape(sm, tr), [])
+        entry = next((e for e in entries if e['guards'] == guards), None)
+        if entry == None:
+            entry = {'guards': guards, 'count': 0, 'transitions': []}
+            entries.append(entry)
+        entry['count'] += 1
+        if sm.name + "." + tr not in entry['transitions']:
+            entry['transitions'].append(sm.name + "." + tr)
+    if cold:
+        library['iterations'][sm.name] = iterations
+    with open(path, 'w') as f:
+        json.dump(library, f, indent=2, sort_keys=True)
+
+def propose(statemachine, candidates, path=TEMPLATES):
+    '''A hypothesis (tr -> candidate indices) for the transitions whose shape has
+       a template all of whose guards are candidates, the most used template first
+    '''
+    sm = statemachine
+    library = load_templates(path)
+    hypothesis = {}
+    for tr in sm.transitions:
+        entries = library['shapes'].get(shape(sm, tr), [])
+        if entries == []:
+            continue
+        pairs = roles(sm, tr)
+        index = {}
+        for i, g in enumerate(candidates[tr]):
+            index.setdefault(abstract(g, pairs), i)
+        for entry in sorted(entries, key=lambda e: -e['count']):
+            if all(g in index for g in entry['guards']):
+                hypothesis[tr] = [index[g] for g in entry['guards']]
+                break
+    return hypothesis
+
+def cold_iterations(name, path=TEMPLATES):
+    '''Iterations of the last run of contract name without templates, None if unknown'''
+    return load_templates(path)['iterations'].get(name)
@@ -1,4 +1,10 @@
 import z3
+import copy
+from collections import OrderedDict
+from lib.expr_utils import free_vars, translate
+
+# number of renamed expressions kept by to_post and to_prev
+RENAME_CACHE_SIZE = 1024
 
 class Ts(object):
     """A transition system
@@ -15,9 +21,11 @@ class Ts(object):
         Bad: v_0 >= 10
         Tr: And(v_0 < 5, v_out_0 == v_0 + 1)
     """
-    def __init__(self, name='Ts'):
+    def __init__(self, name='Ts', ctx=None):
         # string name
         self.name = name
+        # z3 context of the formulas
+        self.ctx = ctx if ctx != None else z3.main_ctx()
         # state variables (pair of input and output)
         self._vars = []
         # inputs
@@ -28,12 +36,18 @@ class Ts(object):
         # maps state variable index to optional name
         self._var_names = list()
 
+        # substitution pairs of to_post and to_prev
+        self._post_pairs = []
+        self._prev_pairs = []
+        # renamed expressions by (direction, AST id), with the expression to pin its id
+        self._renamed = OrderedDict()
+
         # Transition relation
-        self.Tr = z3.BoolVal(True)
+        self.Tr = z3.BoolVal(True, self.ctx)
         # Initial condition
-        self.Init = z3.BoolVal(True)
+        self.Init = z3.BoolVal(True, self.ctx)
         # Bad states
-        self.Bad = z3.BoolVal(False)
+        self.Bad = z3.BoolVal(False, self.ctx)
 
     # def add_tr(self, f):
     #     assert(type(f).__name__ == 'BoolRef')
@@ -48,6 +62,9 @@ class Ts(object):
         v_out = z3.Const(post, sort)
         self._vars.append((v_in, v_out))
         self._var_names.append(name)
+        self._post_pairs.append((v_in, v_out))
+        self._prev_pairs.append((v_out, v_in))
+        self._renamed.clear()
         if name is not None:
             self._named_vars[name] = (v_in, v_out) 
 
@@ -131,7 +148,7 @@ class Ts(object):
         >>> T.to_post(x > y)
         v_out_0 > v_out_1
         '''
-        return z3.substitute(e, *self._vars)
+        return self._rename(e, 'post', self._post_pairs)
     
     def to_prev(self, e):
         '''Rename expression over post-state variables to pre-state variables
@@ -143,8 +160,27 @@ class Ts(object):
         >>> T.to_post(x > y)
         v_out_0 > v_out_1
         '''
-        reversed_vars = [(v, u) for (u, v) in self._vars]
-        return z3.substitute(e, *reversed_vars)
+        return self._rename(e, 'prev', self._prev_pairs)
+
+    def translate(self, ctx):
+        '''A copy of the transition system in the z3 context ctx'''
+        other = copy.copy(self)
+        for k, v in vars(self).items():
+            setattr(other, k, translate(v, ctx))
+        other.ctx = ctx
+        other._renamed = OrderedDict()
+        return other
+
+    def _rename(self, e, direction, pairs):
+        key = (direction, id(e.ctx), e.get_id())
+        if key in self._renamed:
+            self._renamed.move_to_end(key)
+            return self._renamed[key][1]
+        res = z3.substitute(e, *pairs)
+        self._renamed[key] = (e, res)
+        if len(self._renamed) > RENAME_CACHE_SIZE:
+            self._renamed.popitem(last=False)
+        return res
 
     def _new_input_name(self, name=None):
         if name is not None:
@@ -179,11 +215,11 @@ class Ts(object):
         return repr(self)
 
     def filter_pre_vars(self, f):
-        f_vars = get_vars(f)
+        f_vars = free_vars(f)
         vars = filter(lambda x: x[0] in f_vars, self._vars)
         return [u for (u,v) in vars]
 
     def filter_post_vars(self, f):
-        f_vars = get_vars(f)
+        f_vars = free_vars(f)
         vars = filter(lambda x: x[0] in f_vars, self._vars)
         return [v for (u,v) in vars]
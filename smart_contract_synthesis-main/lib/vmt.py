@@ -0,0 +1,162 @@
+'''SMT-LIB2 files in the VMT style for transition systems and state machines.
+
+The first line is a comment holding a JSON description of the model (variable
+pairs and names, transitions, parameters, guards, candidate guards, properties,
+traces) whose formulas refer to the terms of the file by index. Then come the
+declarations, one define-fun |t!i| per non-constant term, and the VMT
+annotations (:next, :init, :trans, :invar-property) read by external checkers,
+one per line.
+
+usage: python3 -m lib.vmt input/erc20.py [erc20.vmt]
+'''
+import z3
+import sys
+import json
+from lib.expr_utils import expr, free_vars
+from lib.ts import Ts
+
+HEADER = '; smart_contract_synthesis '
+
+class Writer(object):
+    '''Numbers the terms written to a file, each distinct term once'''
+    def __init__(self):
+        self.terms = []
+        self.index = {}
+
+    def ref(self, e):
+        e = expr(e)
+        if e.get_id() not in self.index:
+            self.index[e.get_id()] = len(self.terms)
+            self.terms.append(e)
+        return self.index[e.get_id()]
+
+    def symbol(self, i):
+        e = self.terms[i]
+        if z3.is_const(e) and e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+            return e.sexpr()
+        return "|t!%d|" % i
+
+    def text(self, header, vmt):
+        consts = {}
+        for e in self.terms:
+            for v in free_vars(e):
+                consts[v.sexpr()] = v
+        lines = [HEADER + json.dumps(dict(header, terms=[self.symbol(i) for i in range(len(self.terms))]))]
+        lines += ["(declare-fun %s () %s)" % (name, v.sort().sexpr()) for name, v in consts.items()]
+        for i, e in enumerate(self.terms):
+            if self.symbol(i) != e.sexpr():
+                lines.append("(define-fun %s () %s %s)" % (self.symbol(i), e.sort().sexpr(), e.sexpr()))
+        lines += [line.replace('\n', ' ') for line in vmt]
+        return '\n'.join(lines) + '\n'
+
+def ts_header(ts, w):
+    return {'name': ts.name,
+            'vars': [[w.ref(u), w.ref(v), name] for (u, v), name in zip(ts.pre_post_vars(), ts._var_names)],
+            'inputs': [w.ref(i) for i in ts.inputs()],
+            'init': w.ref(ts.Init), 'tr': w.ref(ts.Tr), 'bad': w.ref(ts.Bad)}
+
+def vmt_lines(w, ts, init, trans, properties=[]):
+    '''trans: SMT-LIB text of the transition relation'''
+    lines = ["(define-fun .%s () %s (! %s :next %s))" % (u.decl().name(), u.sort().sexpr(), u.sexpr(), v.sexpr())
+             for u, v in ts.pre_post_vars()]
+    lines.append("(define-fun .init () Bool (! %s :init true))" % w.symbol(w.ref(init)))
+    lines.append("(define-fun .trans () Bool (! %s :trans true))" % trans)
+    for i, p in enumerate(properties):
+        lines.append("(define-fun .property%d () Bool (! %s :invar-property %d))" % (i, w.symbol(w.ref(p)), i))
+    return lines
+
+def dump_ts(ts, path):
+    w = Writer()
+    header = {'kind': 'ts', 'ts': ts_header(ts, w)}
+    with open(path, 'w') as f:
+        f.write(w.text(header, vmt_lines(w, ts, ts.Init, w.symbol(w.ref(ts.Tr)))))
+
+def dump(statemachine, path, properties=[], positive_traces=[], candidate_guard=None):
+    '''Writes the state machine, its properties, positive traces and candidate
+       guards (tr -> list of predicates, as returned by generate_candidate_guards)
+    '''
+    sm = statemachine
+    w = Writer()
+    header = {'kind': 'state_machine', 'ts': ts_header(sm.ts, w),
+              'transitions': [{'name': t,
+                               'parameters': None if sm.tr_parameters[t] == None else [w.ref(p) for p in sm.tr_parameters[t]],
+                               'guard': w.ref(sm.condition_guards[t]),
+                               'transfer_func': w.ref(sm.transfer_func[t]),
+                               'reads': sm.tr_reads[t], 'writes': sm.tr_writes[t],
+                               'candidates': len(sm.candidate_condition_guards[t])} for t in sm.transitions],
+              'constants': [{'term': w.ref(c)} if z3.is_expr(c) else c for c in sm.constants],
+              'properties': [w.ref(p) for p in properties],
+              'positive_traces': [[[step[0]] + [w.ref(e) for e in step[1:]] for step in trace] for trace in positive_traces],
+              'candidate_guard': None if candidate_guard == None else
+                                 {t: [w.ref(g) for g in candidate_guard[t]] for t in candidate_guard}}
+    # the transitions as in bmc, by reference to the terms above
+    step = w.symbol(w.ref(sm.nowOut > sm.now))
+    trans = "(or %s)" % ' '.join("(and %s %s %s)" % (w.symbol(t['transfer_func']), w.symbol(t['guard']), step)
+                                 for t in header['transitions'])
+    with open(path, 'w') as f:
+        f.write(w.text(header, vmt_lines(w, sm.ts, sm.ts.Init, trans, properties)))
+
+def read(path, ctx=None):
+    '''The JSON header of the file and its terms (in z3 context ctx)'''
+    with open(path) as f:
+        first = f.readline()
+        assert first.startswith(HEADER), "%s is not a model written by lib.vmt" % path
+        header = json.loads(first[len(HEADER):])
+        # the VMT annotations are for external tools, z3 warns about them
+        smt = [line for line in f if not line.startswith("(define-fun .")]
+    smt += ["(assert (= %s %s))\n" % (s, s) for s in header['terms']]
+    terms = [a.arg(0) for a in z3.parse_smt2_string(''.join(smt), ctx=ctx)]
+    return header, terms
+
+def load_ts(path, ctx=None):
+    header, terms = read(path, ctx)
+    return make_ts(header['ts'], terms, ctx=ctx)
+
+def make_ts(h, terms, ts=None, ctx=None):
+    ts = ts or Ts(h['name'], ctx)
+    for u, v, name in h['vars'][len(ts.pre_post_vars()):]:
+        ts.add_var(terms[u].sort(), name=name)
+    for i in h['inputs']:
+        ts.add_input(terms[i].sort(), name=terms[i].decl().name())
+    ts.Init, ts.Tr, ts.Bad = terms[h['init']], terms[h['tr']], terms[h['bad']]
+    return ts
+
+def load(path, ctx=None):
+    '''Returns (statemachine, properties, positive_traces, candidate_guard) like
+       lib.contracts.load, in z3 context ctx
+    '''
+    from lib.state_machine import smart_contract_state_machine
+    header, terms = read(path, ctx)
+    h = header['ts']
+    sm = smart_contract_state_machine(h['name'], ctx)
+    # now, func and their prev_ are made by the constructor, add_state makes the prev_ of the others
+    for u, v, name in h['vars'][len(sm.ts.pre_post_vars())::2]:
+        state = sm.add_state(name, terms[u].sort())
+        if name[:5] == "once_":
+            sm.once[name[5:]] = state
+    make_ts(h, terms, sm.ts)
+    for t in header['transitions']:
+        name = t['name']
+        sm.transitions.append(name)
+        sm.tr_parameters[name] = None if t['parameters'] == None else tuple(terms[p] for p in t['parameters'])
+        sm.condition_guards[name] = terms[t['guard']]
+        sm.transfer_func[name] = terms[t['transfer_func']]
+        sm.tr_reads[name] = t['reads']
+        sm.tr_writes[name] = t['writes']
+        sm.candidate_condition_guards[name] = [z3.Const(name+'_'+str(i), z3.BoolSort(sm.ctx)) for i in range(t['candidates'])]
+    sm.constants = [terms[c['term']] if isinstance(c, dict) else c for c in header['constants']]
+    properties = [terms[p] for p in header['properties']]
+    positive_traces = [[tuple([step[0]] + [terms[e] for e in step[1:]]) for step in trace] for trace in header['positive_traces']]
+    candidate_guard = header['candidate_guard']
+    if candidate_guard != None:
+        candidate_guard = {t: [terms[g] for g in candidate_guard[t]] for t in candidate_guard}
+    return sm, properties, positive_traces, candidate_guard
+
+if __name__ == '__main__':
+    from lib.contracts import load as load_script
+    script = sys.argv[1]
+    path = sys.argv[2] if len(sys.argv) > 2 else script.split('/')[-1].replace('.py', '.vmt')
+    statemachine, properties, positive_traces, candidate_guard = load_script(script)
+    if candidate_guard == None:
+        candidate_guard = statemachine.generate_candidate_guards(["<", "<=", ">", ">=", "="], True)
+    dump(statemachine, path, properties, positive_traces, candidate_guard)
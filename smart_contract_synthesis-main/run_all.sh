@@ -1,3 +1,8 @@
+# usage: ./run_all.sh [deadline], deadline in seconds per contract
+if [ -n "$1" ]
+then
+  export CEGIS_DEADLINE="$1"
+fi
 echo "experiment results" > results.out
 for file in ./input/*.py
 do
@@ -0,0 +1,45 @@
+import z3
+import lib.checkpoint
+from lib.state_machine import smart_contract_state_machine
+
+def test_restore(tmp_path, capsys):
+    sm = smart_contract_state_machine('counter', z3.Context())
+    x, xOut = sm.add_state('x', z3.IntSort(sm.ctx))
+    sm.add_tr('inc', (), True, xOut == x + 1)
+    sm.set_init(x == 0)
+    p = x < 10
+    path = str(tmp_path / 'counter.smt2')
+    assert lib.checkpoint.restore(path, sm, [p]) == (None, None)
+    lib.checkpoint.save(path, sm, {'pos': [], 'neg': [], 'ntraces': [[('inc', sm.nowOut == 1)]],
+                                   'candidate_guard': {'inc': [x < 5]}, 'properties': [p],
+                                   'model': sm.fingerprint([p]), 'hypothesis': {'inc': [0]}, 'best': None})
+    state, warm = lib.checkpoint.restore(path, sm, [p])
+    assert warm == None and state['hypothesis'] == {'inc': [0]} and state['candidate_guard']['inc'][0].eq(x < 5)
+    assert lib.checkpoint.restore(path, sm, [p], resume=False) == (None, None)
+    # the properties changed: warm start from the checkpoint
+    state, warm = lib.checkpoint.restore(path, sm, [p, x >= 0])
+    assert state == None and warm['ntraces'][0][0][0] == 'inc'
+    assert "specification changed" in capsys.readouterr().out
+    state, warm = lib.checkpoint.restore(None, sm, [p], warm_start=path)
+    assert state == None and warm['properties'][0].eq(p)
+
+def test_finished_run(tmp_path, capsys):
+    def counter():
+        sm = smart_contract_state_machine('counter', z3.Context())
+        x, xOut = sm.add_state('x', z3.BitVecSort(256, sm.ctx))
+        amount = z3.BitVec('amount', 256, sm.ctx)
+        sm.add_tr('inc', (amount,), True, xOut == x + amount)
+        sm.set_init(x == 0)
+        return sm, [z3.ULE(x, 10)]
+    # the directory is created
+    path = str(tmp_path / 'checkpoints' / 'counter.smt2')
+    sm, properties = counter()
+    first = sm.cegis(properties, [], None, checkpoint=path)
+    assert first.status == 'verified'
+    # the finished run is not run again
+    sm, properties = counter()
+    again = sm.cegis(properties, [], None, checkpoint=path)
+    assert "already verified" in capsys.readouterr().out
+    assert again.status == 'verified' and again.iterations == first.iterations
+    assert again.time <= first.time and again.guards.keys() == first.guards.keys()
+    assert all(again.guards[tr].__str__() == first.guards[tr].__str__() for tr in first.guards)
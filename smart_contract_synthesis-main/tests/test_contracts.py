@@ -0,0 +1,32 @@
+from lib.contracts import load
+from lib.state_machine import smart_contract_state_machine, loading
+
+SCRIPT = '''
+import z3
+from lib.state_machine import smart_contract_state_machine
+statemachine = smart_contract_state_machine('script')
+x, xOut = statemachine.add_state('x', z3.IntSort())
+statemachine.add_tr('inc', (), True, xOut == x + 1)
+statemachine.set_init(x == 0)
+statemachine.cegis([x >= 0], [[('inc', statemachine.nowOut == 1)]], None)
+'''
+
+def test_load(tmp_path):
+    path = tmp_path / 'script.py'
+    path.write_text(SCRIPT)
+    cegis = smart_contract_state_machine.cegis
+    statemachine, properties, positive_traces, candidate_guard = load(str(path))
+    assert statemachine.name == 'script' and len(properties) == 1 and len(positive_traces) == 1
+    assert candidate_guard == None
+    # nothing is patched, and cegis synthesizes again once the script is loaded
+    assert smart_contract_state_machine.cegis is cegis and loading.calls == None
+
+def test_load_failing_script(tmp_path):
+    path = tmp_path / 'script.py'
+    path.write_text(SCRIPT + 'raise SystemExit(1)\n')
+    try:
+        load(str(path))
+        assert False
+    except SystemExit:
+        pass
+    assert loading.calls == None
@@ -0,0 +1,26 @@
+import os
+from lib.pool import ForkServer
+
+def handler(job):
+    if job == 'die':
+        os._exit(1)
+    if job == 'raise':
+        raise ValueError(job)
+    return job * 2
+
+def test_map():
+    pool = ForkServer(handler, 2)
+    try:
+        assert pool.map([1, 2, 3, 4, 5]) == [2, 4, 6, 8, 10]
+        assert pool.map([]) == []
+    finally:
+        pool.close()
+
+def test_dead_worker_only_loses_its_job():
+    pool = ForkServer(handler, 2)
+    try:
+        assert pool.map([1, 'die', 3, 'raise', 5, 6]) == [2, None, 6, None, 10, 12]
+        # the dead worker was forked again
+        assert pool.map([7, 8]) == [14, 16]
+    finally:
+        pool.close()
@@ -0,0 +1,43 @@
+import time
+import os
+import z3
+from lib.portfolio import configs_for, race, record_winner, historical_winner, WINNERS
+
+def test_bitblast_only_for_bit_vectors():
+    x = z3.BitVec('x', 8)
+    a = z3.Array('a', z3.BitVecSort(8), z3.BitVecSort(8))
+    assert 'bitblast' in configs_for(z3.UGT(x, 1))
+    assert 'bitblast' not in configs_for(z3.UGT(a[x], 1))
+    assert 'bitblast' not in configs_for(z3.ForAll([x], z3.UGE(x, 0)))
+    assert 'bitblast' not in configs_for(z3.String('s') == z3.StringVal('bid'))
+
+def test_winners_only_recorded_in_the_output_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('CEGIS_OUTPUT_DIR', raising=False)
+    record_winner('erc20', 'seed1')
+    assert os.listdir(tmp_path) == [] and historical_winner('erc20') == None
+    monkeypatch.setenv('CEGIS_OUTPUT_DIR', str(tmp_path))
+    record_winner('erc20', 'seed1')
+    assert os.listdir(tmp_path) == [WINNERS] and historical_winner('erc20') == 'seed1'
+
+def test_race():
+    def task(job):
+        if job == 'exit':
+            os._exit(1)
+        if job == 'unpicklable':
+            return lambda: None
+        if job == 'raise':
+            raise ValueError(job)
+        return job * 2
+    results = []
+    assert race(task, ['exit', 'unpicklable', 'raise', 3], results=results) == (3, 6)
+    assert results == [(3, 6)]
+    # every result is received, even from processes exiting right after sending
+    for _ in range(20):
+        assert race(task, [1, 2], decisive=lambda r: r == 4) == (2, 4)
+    assert race(task, ['exit', 'raise'], decisive=lambda r: True) == (None, None)
+
+def test_race_timeout():
+    T = time.time()
+    assert race(lambda job: time.sleep(job), [5, 5], timeout=0.2) == (None, None)
+    assert time.time() - T < 2
@@ -0,0 +1,23 @@
+import z3
+from lib.ts import Ts
+from lib.prove import prove_inductive, prove_inductive_all
+
+def counter():
+    ts = Ts('counter', z3.Context())
+    x, x_out = ts.add_var(z3.IntSort(ts.ctx), name='x')
+    ts.Init = x == 0
+    ts.Tr = x_out == x + 1
+    return ts, x
+
+def test_prove_inductive(capsys):
+    ts, x = counter()
+    s = prove_inductive(ts, x >= 0)
+    assert isinstance(s, z3.Solver) and s.check() == z3.unsat
+    assert capsys.readouterr().out.count("proved") == 2
+
+def test_prove_inductive_all(capsys):
+    ts, x = counter()
+    results = prove_inductive_all(ts, [x >= 0, x <= 1])
+    assert [(r1.status, r2.status) for r1, r2 in results] == [('proved', 'proved'), ('proved', 'failed')]
+    assert results[1][1].counterexample().eval(x).as_long() >= 1
+    assert capsys.readouterr().out == ""
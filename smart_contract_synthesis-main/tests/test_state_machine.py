@@ -0,0 +1,280 @@
+import time
+import z3
+from lib.state_machine import smart_contract_state_machine, CegisOptions, ddmin
+import lib.bmc
+from lib.bmc import BOUND
+from lib.expr_utils import contains
+
+def counter():
+    '''x counts up by amount (sender is ignored), reset sets it back to 0'''
+    sm = smart_contract_state_machine('counter', z3.Context())
+    x, xOut = sm.add_state('x', z3.BitVecSort(256, sm.ctx))
+    amount = z3.BitVec('amount', 256, sm.ctx)
+    sender = z3.BitVec('sender', 256, sm.ctx)
+    sm.add_tr('inc', (amount, sender), True, xOut == x + amount)
+    sm.add_tr('reset', (), True, xOut == 0)
+    sm.add_once()
+    sm.set_init(x == 0)
+    return sm, x, amount, sender
+
+def test_ddmin_keeps_the_failure_inducing_items():
+    assert ddmin(list(range(10)), lambda l: {2, 5, 7} <= set(l)) == [2, 5, 7]
+
+def test_ddmin_is_1_minimal():
+    test = lambda l: (3 in l and 8 in l) or sum(l) >= 20
+    result = ddmin(list(range(10)), test)
+    assert test(result)
+    assert all(not test(result[:i] + result[i + 1:]) for i in range(len(result)))
+
+def test_ddmin_empty():
+    assert ddmin([], lambda l: True) == []
+    assert ddmin([], lambda l: l != []) == []
+
+def test_ddmin_returns_items_that_do_not_pass():
+    assert ddmin([1, 2, 3], lambda l: False) == [1, 2, 3]
+
+def test_minimize_trace_steps_and_values():
+    sm, x, amount, sender = counter()
+    step = lambda tr, now, *params: tuple([tr, sm.nowOut == now] + list(params))
+    trace = [step('inc', 1, amount == 3, sender == 1), step('reset', 2),
+             step('inc', 3, amount == 20, sender == 2), step('inc', 4, amount == 1, sender == 3)]
+    property = z3.ULT(x, 10)
+    steps = sm.minimize_trace(trace, property)
+    assert steps == [trace[2]]
+    values = sm.minimize_trace(trace, property, values=True)
+    assert sm.check_trace(values, z3.Not(property))
+    # the amount is needed, the sender is not
+    value = lambda c: [a for a in c.children() if z3.is_bv_value(a)][0].as_long()
+    assert (value(values[0][2]), value(values[0][3])) == (20, 0)
+
+def test_minimize_trace_empty():
+    sm, x, amount, sender = counter()
+    assert sm.minimize_trace([], z3.ULT(x, 10)) == []
+
+def test_select_observations():
+    sm, x, amount, sender = counter()
+    b = lambda *vs: [z3.BoolVal(v, sm.ctx) for v in vs]
+    # rows of inc with the values of its candidates 0, 1 and 2
+    traces = [[['inc'] + b(True, False, False)],
+              [['inc'] + b(True, True, False)],
+              [['inc'] + b(True, True, True)]]
+    samples = [{'inc': [0], 'reset': []}, {'inc': [1], 'reset': []}, {'inc': [2], 'reset': []}]
+    # all three sampled hypotheses accept the last trace, the first two the second
+    assert sm.select_observations(traces, samples, [0, 0, 0]) == [2]
+    # one trace per group, even when it rejects none of the hypotheses left
+    assert sm.select_observations(traces, samples, [0, 1, 1]) == [2, 0]
+    # the gain of a trace with a symbolic value is unknown, it is kept
+    traces[0][0][2] = sm.once['reset'][0]
+    assert not sm.ground(traces[0]) and sm.ground(traces[1])
+    assert sm.select_observations(traces, samples, [0, 0, 0]) == [0, 2]
+
+def test_reach_depth():
+    sm = smart_contract_state_machine('chain', z3.Context())
+    x, xOut = sm.add_state('x', z3.IntSort(sm.ctx))
+    y, yOut = sm.add_state('y', z3.IntSort(sm.ctx))
+    z, zOut = sm.add_state('z', z3.IntSort(sm.ctx))
+    sm.add_tr('a', (), True, xOut == 1)
+    sm.add_tr('b', (), True, yOut == x)
+    sm.add_tr('c', (), True, zOut == y)
+    # a feeds b feeds c
+    assert sm.reach_depth() == 4
+    assert sm.depth_schedule(7) == [2, 4, 7]
+
+def test_reach_depth_dense():
+    sm = smart_contract_state_machine('dense', z3.Context())
+    x, xOut = sm.add_state('x', z3.IntSort(sm.ctx))
+    for i in range(20):
+        sm.add_tr('t%d' % i, (), True, xOut == x + i)
+    # every transition feeds every other one: one component, capped at the bound
+    assert sm.reach_depth() == BOUND
+    # cached until the transitions change
+    sm.add_tr('t20', (), True, xOut == x + 20)
+    assert sm.reach_depth() == BOUND and sm.reach[0] == tuple(sm.transitions)
+
+def auction():
+    '''bid raises the highest bid, deposit credits an account, end closes'''
+    sm = smart_contract_state_machine('auction', z3.Context())
+    bv = z3.BitVecSort(256, sm.ctx)
+    highestbid, highestbidOut = sm.add_state('highestbid', bv)
+    balance, balanceOut = sm.add_state('balance', z3.ArraySort(bv, bv))
+    ended, endedOut = sm.add_state('ended', z3.BoolSort(sm.ctx))
+    value = z3.BitVec('value', 256, sm.ctx)
+    sender = z3.BitVec('sender', 256, sm.ctx)
+    amount = z3.BitVec('amount', 256, sm.ctx)
+    sm.add_tr('bid', (value,), True, highestbidOut == value)
+    sm.add_tr('deposit', (sender, amount), True, balanceOut == z3.Update(balance, sender, balance[sender] + amount))
+    sm.add_tr('end', (), True, endedOut == True)
+    sm.add_once()
+    sm.set_init(z3.And(highestbid == 0, ended == False, balance == z3.K(bv, z3.BitVecVal(0, 256, sm.ctx))))
+    return sm, highestbid, balance, ended, value, sender, amount
+
+def test_independent():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    assert sm.independent('bid', 'deposit') and sm.independent('deposit', 'end')
+    assert not sm.independent('bid', 'bid')
+    assert [(b.arg(1).as_string(), a.arg(1).as_string()) for b, a in sm.commuting_pairs()] == \
+           [('deposit', 'bid'), ('end', 'bid'), ('end', 'deposit')]
+    # reading the time makes a transition depend on every other one
+    sm.change_guard('end', sm.nowOut > 100)
+    assert not sm.independent('deposit', 'end') and sm.independent('bid', 'deposit')
+
+def test_independent_read_write():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    sm.add_tr('close', (), True, sm.states['ended'][1] == (highestbid > 10))
+    assert not sm.independent('bid', 'close') and not sm.independent('end', 'close')
+    assert sm.independent('deposit', 'close')
+
+def test_por_keeps_violations():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    bad = z3.And(ended, highestbid > 5)
+    for por in (False, True):
+        trace = sm.bmc(bad, por=por, bound=3)
+        assert [step[0] for step in trace] in (['bid', 'end'], ['end', 'bid'])
+    assert sm.bmc(z3.And(ended, sm.once['bid'][0] == False, highestbid > 5), por=True, bound=3) == None
+
+def test_symmetry():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    # sender only indexes balance, amount is added to it
+    assert [v.__str__() for v in sm.address_parameters(balance[sender] > 5)] == ['sender']
+    assert [(v.__str__(), t.arg(1).as_string()) for v, t in sm.symmetric_parameters(balance[sender] > 5)] == [('sender', 'deposit')]
+    # compared to a constant, sender is no longer interchangeable
+    assert sm.address_parameters(z3.And(balance[sender] > 5, sender == 7)) == []
+    a = z3.BitVec('a', 256, sm.ctx)
+    bad = z3.Exists([a], z3.UGT(balance[a], 100))
+    for symmetry in (False, True):
+        trace = sm.bmc(bad, symmetry=symmetry, bound=2)
+        assert trace != None and sm.check_trace(trace, bad)
+
+def test_weakest_preconditions():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    prev = sm.prev_states['highestbid'][0]
+    raises = z3.Implies(sm.func == 'bid', z3.UGT(highestbid, prev))
+    once = z3.Implies(sm.func == 'end', sm.once['bid'][0])
+    wps = sm.weakest_preconditions([raises, once])
+    assert [c.__str__() for c in wps['bid']] == [z3.Not(z3.ULE(value, highestbid)).__str__()]
+    # once_bid is not fixed by simulate, not a candidate
+    assert wps['deposit'] == [] and wps['end'] == []
+    candidates = sm.generate_candidate_guards(["<", "="], True)
+    n = len(candidates['bid'])
+    candidates, hypothesis = sm.add_candidates(candidates, wps)
+    assert candidates['bid'][0].eq(wps['bid'][0]) and len(candidates['bid']) == n + 1
+    assert hypothesis == {'bid': [0], 'deposit': [], 'end': []}
+    assert len(sm.candidate_condition_guards['bid']) == n + 1
+
+def test_options():
+    o = CegisOptions(samples=4)
+    assert o.samples == 4 and o.minimize == False and o.wp == False and o.depth == BOUND
+    assert o.update(wp=True) is o and o.wp
+    try:
+        CegisOptions(sample=4)
+        assert False
+    except TypeError:
+        pass
+
+def test_add_counterexamples():
+    sm, x, amount, sender = counter()
+    step = lambda tr, now, *params: tuple([tr, sm.nowOut == now] + list(params))
+    a = [step('inc', 1, amount == 3, sender == 1), step('inc', 2, amount == 20, sender == 2)]
+    b = [step('inc', 2, amount == 20, sender == 2)]
+    ntraces, sources = [], []
+    assert sm.add_counterexamples(ntraces, sources, 0, [a, b], z3.ULT(x, 10)) == 0
+    assert ntraces == [a, b] and sources == [0, 0]
+    # minimized, a becomes b
+    ntraces, sources = [], []
+    assert sm.add_counterexamples(ntraces, sources, 1, [a, b], z3.ULT(x, 10), minimize=True) == 1
+    assert ntraces == [b] and sources == [1]
+
+def test_deadline_during_verification():
+    sm, x, amount, sender = counter()
+    def verify_hypotheses(properties, hypotheses, *args):
+        time.sleep(0.3)
+        return [[('inconclusive', []) for p in properties] for h in hypotheses]
+    sm.verify_hypotheses = verify_hypotheses
+    result = sm.cegis([z3.ULE(x, 10)], [], None, deadline=0.2)
+    assert result.status == 'deadline' and result.iterations == 1
+    # the last verification counts
+    assert result.verification_time >= 0.3
+
+def test_given_candidate_guards():
+    sm, x, amount, sender = counter()
+    # more candidates for inc than there are transitions
+    candidates = {'inc': [sender == 0, z3.ULE(amount, 5), z3.ULE(x + amount, 10)], 'reset': []}
+    result = sm.cegis([z3.ULE(x, 10)], [], candidates)
+    assert [len(sm.candidate_condition_guards[tr]) for tr in ('inc', 'reset')] == [3, 0]
+    assert result.status == 'verified' and 2 in result.hypothesis['inc']
+
+def test_cubes_against_plain_bmc():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    # bid then end, at depth 2: the cube bid, bid only violates it at depth 3
+    bad = z3.And(ended, z3.UGT(highestbid, 5), sm.once['bid'][0])
+    assert [step[0] for step in sm.bmc(bad, bound=3)] == ['bid', 'end']
+    plain = sm.last_bmc
+    for cubes in (1, 2):
+        trace = sm.bmc(bad, bound=3, cubes=cubes)
+        assert sm.check_trace(trace, bad) and sm.last_bmc.status == 'violated'
+        # a depth proved in the cube that won only is not proved
+        assert all(sm.last_bmc.depths.get(d) != 'proved' for d, s in plain.depths.items() if s == 'violated')
+    safe = z3.And(ended, z3.UGT(highestbid, 5), z3.Not(sm.once['bid'][0]))
+    assert sm.bmc(safe, bound=3) == None and sm.bmc(safe, bound=3, cubes=2) == None
+    assert sm.last_bmc.status == 'proved' and sm.last_bmc.depths == {d: 'proved' for d in range(4)}
+    # the cubes stop once the budget of the call is spent
+    sm.bmc_budget = 1
+    T = time.time()
+    assert sm.bmc(safe, bound=3, cubes=2) == None and sm.last_bmc.status == 'inconclusive'
+    assert time.time() - T < 5
+
+def test_diverse_counterexamples():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    bad = z3.And(ended, z3.UGT(highestbid, 5), sm.once['bid'][0])
+    sm.bmc(bad, bound=3, count=4)
+    traces = sm.last_traces
+    assert len(traces) == 4 and len(set(t.__str__() for t in traces)) == 4
+    assert all(sm.check_trace(t, bad) for t in traces)
+    # another transaction sequence first
+    assert {tuple(step[0] for step in t) for t in traces[:2]} == {('bid', 'end'), ('end', 'bid')}
+    xs, xns = sm.unrolled_vars()
+    fvs = sm.parameters()
+    sequence, keys = sm.trace_blocks()
+    # blocked on the sequence alone, there are two
+    result = lib.bmc.bmc(sm.ts.Init, sm.ts.Tr, bad, fvs, xs, xns, bound=3, count=4, block=(sequence, []))
+    assert sorted([step[0] for step in sm.model_trace(m, 2, xs, xns, fvs)] for m in result.models) == [['bid', 'end'], ['end', 'bid']]
+    result = lib.bmc.bmc(sm.ts.Init, sm.ts.Tr, bad, fvs, xs, xns, bound=3, count=4, block=(sequence, keys))
+    assert len(set(sm.model_trace(m, 2, xs, xns, fvs).__str__() for m in result.models)) == 4
+
+def test_speculate():
+    sm, x, amount, sender = counter()
+    plain = sm.cegis([z3.ULE(x, 10)], [], None)
+    sm, x, amount, sender = counter()
+    speculative = sm.cegis([z3.ULE(x, 10)], [], None, speculate=3)
+    assert (speculative.status, speculative.guards.__str__()) == (plain.status, plain.guards.__str__())
+    properties = lambda highestbid, ended: [z3.Implies(ended, z3.ULE(highestbid, 100))]
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    plain = sm.cegis(properties(highestbid, ended), [], None)
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    speculative = sm.cegis(properties(highestbid, ended), [], None, speculate=3)
+    assert speculative.status == plain.status == 'verified'
+    # another hypothesis may verify first, the guards kept verify the properties
+    assert all(sm.bmc(z3.Not(p)) == None and sm.last_bmc.status == 'proved' for p in properties(highestbid, ended))
+
+def test_bmc_abstract():
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    # pay reads balance, which bad does not mention
+    sm.add_tr('pay', (sender,), True, sm.states['highestbid'][1] == balance[sender])
+    sm.change_guard('bid', z3.ULE(value, 100))
+    bad = z3.UGT(highestbid, 100)
+    init, transfer_func = sm.havoc_arrays(['balance'])
+    assert not contains(balance, init) and not contains(sm.states['balance'][1], transfer_func['deposit'])
+    assert contains(balance, transfer_func['pay'])
+    concrete = sm.bmc(bad)
+    assert [step[0] for step in concrete] == ['deposit', 'pay']
+    traces = []
+    bmc_model = sm.bmc_model
+    def record(*args):
+        traces.append(bmc_model(*args))
+        return traces[-1]
+    sm.bmc_model = record
+    trace = sm.bmc(bad, abstract_arrays=True)
+    # with balance havocked pay alone reaches bad, which the concrete model rejects
+    assert [step[0] for step in traces[0]] == ['pay'] and not sm.check_trace(traces[0], bad)
+    assert len(traces) == 2 and trace is traces[1]
+    assert [step[0] for step in trace] == ['deposit', 'pay'] and sm.check_trace(trace, bad)
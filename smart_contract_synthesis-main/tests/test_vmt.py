@@ -0,0 +1,23 @@
+import z3
+import lib.vmt
+from test_state_machine import auction
+
+def test_round_trip(tmp_path):
+    sm, highestbid, balance, ended, value, sender, amount = auction()
+    sm.change_guard('end', z3.UGT(highestbid, 5))
+    # the first is violated (bid, end), the second holds
+    properties = [z3.Implies(ended, z3.ULE(highestbid, 5)), z3.Implies(ended, sm.once['bid'][0])]
+    positive_traces = [[('bid', sm.nowOut == 1, value == 10), ('end', sm.nowOut == 2)]]
+    path = str(tmp_path / 'auction.vmt')
+    lib.vmt.dump(sm, path, properties, positive_traces)
+    loaded, loaded_properties, loaded_traces, candidate_guard = lib.vmt.load(path, z3.Context())
+    assert loaded.transitions == sm.transitions and candidate_guard == None
+    assert [p.sexpr() for p in loaded_properties] == [p.sexpr() for p in properties]
+    assert loaded_traces.__str__() == positive_traces.__str__()
+    for p, q, violated in zip(properties, loaded_properties, (True, False)):
+        trace = sm.bmc(z3.Not(p), bound=3)
+        assert (trace != None) == violated
+        status, depths = sm.last_bmc.status, sm.last_bmc.depths
+        loaded_trace = loaded.bmc(z3.Not(q), bound=3)
+        assert (loaded.last_bmc.status, loaded.last_bmc.depths) == (status, depths)
+        assert loaded_trace.__str__() == trace.__str__() or loaded.check_trace(loaded_trace, z3.Not(q))